@@ -0,0 +1,486 @@
+# -- coding: utf-8 --
+
+"""
+Benchmarks of the report generation, run `python benchmarks.py --help` for the list.
+"""
+
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import click
+
+from fake_redmine import FakeRedmineData, FakeRedmineServer, make_time_entry
+from main import (ExcelAdapter, FetchPlan, RedmineAdapter, TemplateCache, WorkTable, excel_adapters, gen_excel,
+                  load_row_plan, render_rows_parallel, row_modes, table_adapters)
+
+
+class NullAdapter(object):
+    """
+    an ExcelAdapter that only counts the calls, so the benchmarks measure WorkTable itself
+    """
+    def __init__(self):
+        self.text_count = 0
+        self.merge_count = 0
+
+    def set_text(self, text, row_index=1, column_index=1):
+        self.text_count += 1
+
+    def get_cell(self, row_index=1, column_index=1, **kwargs):
+        return row_index, column_index
+
+    def merge(self, src_cell, dst_cell):
+        self.merge_count += 1
+
+
+class LegacyMergeWorkTable(WorkTable):
+    """
+    the merge tracking of 1.0.0, every run is an OrderedDict of {row: (column, data)}
+    """
+    def _has_equal_cached_data(self, data):
+        if not self._cached_data[self.column_count]:
+            return False
+
+        for key, value in self._cached_data[self.column_count].items():
+            if value[1] != data:
+                return False
+
+        return True
+
+    def merge_cur_column_cells(self):
+        current_data = self._cached_data[self.column_count]
+        self.merge_cells(current_data, self.column_count)
+
+    def merge_cells(self, current_data, column_index):
+        columns = list(current_data.items())
+        if current_data and len(columns) >= 2:
+            current_column = columns[0][1][0]
+            current_row = columns[0][0]
+            src_cell = self.adapter.get_cell(current_row, current_column)
+            dst_cell = self.adapter.get_cell(columns[-1][0], current_column)
+            self.adapter.set_text(columns[0][1][1], row_index=current_row, column_index=current_column)
+            self.adapter.merge(src_cell, dst_cell)
+            self._cached_data[column_index] = OrderedDict()
+        elif current_data and len(columns) == 1:
+            current_column = columns[0][1][0]
+            current_row = columns[0][0]
+            self.adapter.set_text(columns[0][1][1], row_index=current_row, column_index=current_column)
+            self._cached_data[column_index] = OrderedDict()
+
+    def write(self, can_merge: bool, data: str, **context):
+        if can_merge:
+            if not self._has_equal_cached_data(data):
+                self.merge_cur_column_cells()
+            self._cached_data[self.column_count].update(
+                {self.current_row: (self.current_column, data)}
+            )
+        else:
+            self.adapter.set_text(data, row_index=self.current_row, column_index=self.current_column)
+
+
+def time_merge(work_table_class, rows, run_length):
+    adapter = NullAdapter()
+    work_table = work_table_class(adapter, None)
+    work_table._cached_data = [None] if work_table_class is WorkTable else [OrderedDict()]
+    started = time.perf_counter()
+    for row_index in range(rows):
+        work_table.column_count = 0
+        work_table.write(True, 'project{0}'.format(row_index // run_length if run_length else 0))
+        work_table.row_count += 1
+    work_table.merge_all_cells()
+    return time.perf_counter() - started, adapter.merge_count
+
+
+@click.group()
+def benchmarks():
+    """WorkTable and RedmineAdapter benchmarks"""
+
+
+@benchmarks.command()
+@click.option("--rows", default=100000, help="rows of the sheet")
+@click.option("--run-length", default=0, help="rows of each run of equal values, 0 for a single run")
+@click.option("--legacy-rows", default=10000, help="rows for the 1.0.0 merge tracking, it is quadratic")
+def merge(rows, run_length, legacy_rows):
+    """Merge tracking of a column with long runs of equal values"""
+    for name, work_table_class, row_count in (('current', WorkTable, rows),
+                                              ('1.0.0', LegacyMergeWorkTable, min(rows, legacy_rows))):
+        seconds, merge_count = time_merge(work_table_class, row_count, run_length)
+        click.echo('{0:>8}: {1} rows, {2} merges in {3:.3f}s, {4:.0f} rows/s'.format(
+            name, row_count, merge_count, seconds, row_count / seconds))
+
+
+@benchmarks.command('import-time')
+@click.option("--repeat", default=5, help="fresh interpreters to start")
+def import_time(repeat):
+    """Time of `import main` and `main.py --help` in a fresh interpreter"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name, command in (('import', [sys.executable, '-c', 'import main']),
+                          ('--help', [sys.executable, 'main.py', '--help'])):
+        seconds = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.check_call(command, cwd=directory, stdout=subprocess.DEVNULL)
+            seconds.append(time.perf_counter() - started)
+        click.echo('{0:>8}: best {1:.3f}s, mean {2:.3f}s of {3} runs'.format(
+            name, min(seconds), sum(seconds) / len(seconds), repeat))
+
+
+class BenchmarkRedmineData(FakeRedmineData):
+    """
+    the data does not change during a benchmark, so the filtered time entries are kept between the pages
+    """
+    def __init__(self, *args, **kwargs):
+        super(BenchmarkRedmineData, self).__init__(*args, **kwargs)
+        self._time_entries = {}
+
+    def filter_time_entries(self, *key):
+        if key not in self._time_entries:
+            self._time_entries[key] = super(BenchmarkRedmineData, self).filter_time_entries(*key)
+        return self._time_entries[key]
+
+
+def generate_dataset(time_entries, projects=20, users=50, issues=2000, depth=2):
+    """
+    a reproducible Redmine of June 2020, the projects form a tree below project 1
+    and carry the custom fields of `Project.custom_attributes`
+    """
+    project_list = []
+    for i in range(1, projects + 1):
+        project = {'id': i, 'name': 'project{0}'.format(i), 'identifier': 'project{0}'.format(i),
+                   'custom_fields': [{'id': 1, 'name': '项目编号', 'value': 'P{0:04d}'.format(i)},
+                                     {'id': 2, 'name': '项目负责人', 'value': 'leader{0}'.format(i % 5)},
+                                     {'id': 3, 'name': '产品分类', 'value': ''}]}
+        #  a tree of `depth` levels, project i is below project i // 2
+        if 1 < i < 2 ** (depth + 1):
+            project['parent'] = {'id': i // 2}
+        project_list.append(project)
+    user_list = [{'id': i, 'login': 'user{0}'.format(i), 'firstname': 'first{0}'.format(i),
+                  'lastname': 'last{0}'.format(i)} for i in range(1, users + 1)]
+    issue_list = [{'id': i, 'subject': 'issue{0}'.format(i), 'project': {'id': project_list[i % projects]['id']},
+                   'updated_on': '2020-06-01T08:00:00Z'} for i in range(1, issues + 1)]
+    time_entry_list = [make_time_entry(i, project_list[i % projects], user_list[i % users],
+                                       issue=issue_list[i % issues], hours=0.5 * (i % 4 + 1),
+                                       spent_on='2020-06-{0:02d}'.format(i % 30 + 1))
+                       for i in range(1, time_entries + 1)]
+    return BenchmarkRedmineData(projects=project_list, users=user_list, issues=issue_list,
+                                time_entries=time_entry_list)
+
+
+def generate_time_entries(count):
+    return generate_dataset(count).time_entries
+
+
+@benchmarks.command()
+@click.option("--time-entries", default=50000, help="time entries of the period")
+def model(time_entries):
+    """Memory of the Projects object graph built from the time entries"""
+    from redminelib import Redmine
+
+    redmine = Redmine('http://localhost')
+    raw_time_entries = generate_time_entries(time_entries)
+    tracemalloc.start()
+    started = time.perf_counter()
+    work_times = [redmine.time_entry.to_resource(raw) for raw in raw_time_entries]
+    projects = RedmineAdapter.build_projects(SimpleNamespace(redmine=redmine, fetch_plan=None), work_times)
+    seconds = time.perf_counter() - started
+    del work_times
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    spent_time = sum(user.spent_time for project in projects.projects for user in project.users)
+    click.echo('{0} time entries in {1:.3f}s, graph {2:.1f}MB, peak {3:.1f}MB, {4} days'.format(
+        time_entries, seconds, current / 2 ** 20, peak / 2 ** 20, spent_time))
+
+
+def legacy_spent_time(projects):
+    """
+    the per object sums of 1.0.0, {(project, user): days} and {(project, user, task): hours}
+    """
+    user_totals, task_totals = {}, {}
+    for project in projects.projects:
+        for user in project.users:
+            user_spent_time = 0
+            for task in user.tasks:
+                spent_time = 0
+                for work_time in task.work_times:
+                    hours = work_time.hours
+                    if isinstance(hours, float):
+                        spent_time += hours
+                task_totals[(project.uid, user.uid, task.uid)] = spent_time
+                user_spent_time += spent_time
+            user_totals[(project.uid, user.uid)] = round(user_spent_time / 8.0, 2)
+    return user_totals, task_totals
+
+
+def vectorized_spent_time(projects):
+    time_entries = projects.time_entries
+    #  measure the arrays and the group by, not the memoized totals
+    time_entries._arrays = None
+    time_entries._totals.clear()
+    user_totals = {key: round(hours / 8.0, 2) for key, hours in time_entries.totals('project', 'user').items()}
+    return user_totals, time_entries.totals('project', 'user', 'task')
+
+
+@benchmarks.command()
+@click.option("--time-entries", default=100000, help="time entries of the period")
+@click.option("--repeat", default=3, help="runs of each path")
+def aggregate(time_entries, repeat):
+    """Spent time of every user and task, per object sums against the TimeEntryTable"""
+    from redminelib import Redmine
+
+    redmine = Redmine('http://localhost')
+    work_times = [redmine.time_entry.to_resource(raw) for raw in generate_time_entries(time_entries)]
+    projects = RedmineAdapter.build_projects(SimpleNamespace(redmine=redmine, fetch_plan=None), work_times)
+    results = []
+    for name, function in (('per object', legacy_spent_time), ('vectorized', vectorized_spent_time)):
+        seconds = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function(projects)
+            seconds.append(time.perf_counter() - started)
+        results.append(result)
+        click.echo('{0:>10}: {1} time entries, {2} users, {3} tasks in {4:.3f}s'.format(
+            name, time_entries, len(result[0]), len(result[1]), min(seconds)))
+    assert results[0][0] == results[1][0]
+
+
+BENCHMARK_TEMPLATE_COLUMNS = [
+    ('项目名称', '{{ project.name }}{# merge #}'),
+    ('项目编号', '{{ project.custom_num }}{# merge #}'),
+    ('项目负责人', '{{ project.custom_leader }}'),
+    ('姓名', '{{ current_user.fullname }}'),
+    ('工时', '{{ current_user.spent_time }}'),
+    ('任务数', '{{ current_user.tasks|list|length }}'),
+    ('部门', 'SPDM'),
+]
+
+#  the columns of a detail sheet, one row per time entry
+DETAIL_TEMPLATE_COLUMNS = [
+    ('项目名称', '{{ project.name }}{# merge #}'),
+    ('姓名', '{{ current_user.name }}{# merge #}'),
+    ('任务', '{{ task.uid }}'),
+    ('日期', '{{ work_time.spent_on }}'),
+    ('工时', '{{ work_time.hours }}'),
+]
+
+
+@contextlib.contextmanager
+def template_directory(columns=BENCHMARK_TEMPLATE_COLUMNS):
+    """
+    a temporary working directory with a template.xlsx
+    """
+    from openpyxl import Workbook
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        workbook = Workbook()
+        for column_index, (field_text, render_text) in enumerate(columns, 1):
+            workbook.active.cell(row=1, column=column_index, value=field_text)
+            workbook.active.cell(row=2, column=column_index, value=render_text)
+        workbook.save(os.path.join(directory, 'template.xlsx'))
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+
+def measure(function, memory):
+    """
+    :return: (seconds, peak MB or None, result), the peak is measured by a second run under tracemalloc,
+             the fake Redmine runs in this process so its allocations count as well
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - started
+        peak = None
+        if memory:
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+    return seconds, peak, result
+
+
+def run_suite(url, time_entries, engine, memory):
+    """
+    time RedmineAdapter.get_projects, WorkTable.process and a whole gen_excel run against `url`
+    """
+    def get_projects():
+        redmine = RedmineAdapter(url, key='fake', month=6, year=2020)
+        try:
+            return redmine.get_projects()
+        finally:
+            redmine.close()
+
+    seconds, peak, projects = measure(get_projects, memory)
+    yield 'get_projects', seconds, peak
+
+    def process():
+        adapter = excel_adapters[engine]('template.xlsx', 'benchmark.xlsx')
+        WorkTable(adapter, projects, enable_merge=True).process(open_excel=False)
+
+    seconds, peak, _ = measure(process, memory)
+    yield 'process', seconds, peak
+
+    def run_gen_excel():
+        gen_excel.main(['--key', 'fake', '--url', url, '--month', '6', '--year', '2020', '--engine', engine,
+                        '--enable-merge-cells', '--no-open-excel'], standalone_mode=False)
+
+    seconds, peak, _ = measure(run_gen_excel, memory)
+    yield 'gen_excel', seconds, peak
+
+
+@benchmarks.command()
+@click.option("--sizes", default='1000,10000,100000', help="time entries of each dataset, comma separated")
+@click.option("--engine", default='memory', type=click.Choice(list(excel_adapters.keys())), help="Excel engine")
+@click.option("--memory/--no-memory", default=True, help="measure the peak memory with a second run")
+@click.option("--report", default=None, help="also write the results to this JSON file")
+def suite(sizes, engine, memory, report):
+    """get_projects, WorkTable.process and gen_excel against a local fake Redmine"""
+    results = []
+    for size in [int(size) for size in sizes.split(',')]:
+        with FakeRedmineServer(generate_dataset(size)) as server, template_directory():
+            for step, seconds, peak in run_suite(server.url, size, engine, memory):
+                results.append(OrderedDict([('time_entries', size), ('step', step), ('seconds', round(seconds, 3)),
+                                            ('time_entries_per_second', round(size / seconds)),
+                                            ('peak_mb', None if peak is None else round(peak, 1))]))
+                click.echo('{0:>7} {1:>12}: {2:8.3f}s {3:>9} entries/s  peak {4}'.format(
+                    size, step, seconds, results[-1]['time_entries_per_second'],
+                    '-' if peak is None else '{0:.1f}MB'.format(peak)))
+    if report is not None:
+        with open(report, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+@benchmarks.command()
+@click.option("--time-entries", default=100000, help="time entries of the period")
+@click.option("--projects", default=101, help="projects, the rows are the users of each project")
+@click.option("--users", default=997, help="users, coprime with the projects so that most pairs have time entries")
+@click.option("--jobs", default=4, help="rendering processes")
+def render(time_entries, projects, users, jobs):
+    """Rendering of the rows in this process against `jobs` processes"""
+    data = generate_dataset(time_entries, projects=projects, users=users)
+    with FakeRedmineServer(data) as server, template_directory():
+        row_plan = load_row_plan('template.xlsx')
+        fetch_plan = FetchPlan.from_row_plan(row_plan)
+        with contextlib.redirect_stdout(io.StringIO()):
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, fetch_plan=fetch_plan)
+            projects = redmine.get_projects()
+        rows = list(WorkTable.pre_process(projects))
+        for name, render_rows in (
+                ('sequential', lambda: [row_plan.render(project=project, current_user=user) for project, user in rows]),
+                ('{0} jobs'.format(jobs), lambda: list(render_rows_parallel(row_plan, fetch_plan, rows, jobs)))):
+            started = time.perf_counter()
+            render_rows()
+            seconds = time.perf_counter() - started
+            click.echo('{0:>10}: {1} rows in {2:.3f}s, {3:.0f} rows/s'.format(
+                name, len(rows), seconds, len(rows) / seconds))
+
+
+@benchmarks.command()
+@click.option("--time-entries", default=100000, help="time entries of the period")
+@click.option("--engine", default='streaming', type=click.Choice(list(excel_adapters.keys())), help="Excel engine")
+def rows(time_entries, engine):
+    """Row table and sheet of each row mode, the detail sheet has one row per time entry"""
+    data = generate_dataset(time_entries)
+    with FakeRedmineServer(data) as server:
+        with contextlib.redirect_stdout(io.StringIO()):
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020)
+            projects = redmine.get_projects()
+        for row_mode, variables in row_modes.items():
+            #  the columns of the variables of the row mode
+            columns = [(field_text, render_text) for field_text, render_text in DETAIL_TEMPLATE_COLUMNS
+                       if render_text.split()[1].split('.')[0] in variables]
+            with template_directory(columns):
+                started = time.perf_counter()
+                row_count = len(projects.get_rows(row_mode))
+                table_seconds = time.perf_counter() - started
+                adapter = excel_adapters[engine]('template.xlsx', '{0}.xlsx'.format(row_mode))
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    WorkTable(adapter, projects, row_mode=row_mode).process(open_excel=False)
+                seconds = time.perf_counter() - started
+            click.echo('{0:>10}: {1:>7} rows, row table {2:.3f}s, sheet {3:.3f}s, {4:.0f} rows/s'.format(
+                row_mode, row_count, table_seconds, seconds, row_count / seconds))
+
+
+@benchmarks.command()
+@click.option("--time-entries", default=100000, help="time entries of the period")
+@click.option("--row-mode", default='time_entry', type=click.Choice(list(row_modes.keys())), help="row mode")
+def pipeline(time_entries, row_mode):
+    """gen_excel with the phases one after another against --pipeline, time and peak memory"""
+    columns = [(field_text, render_text) for field_text, render_text in DETAIL_TEMPLATE_COLUMNS
+               if render_text.split()[1].split('.')[0] in row_modes[row_mode]]
+    with FakeRedmineServer(generate_dataset(time_entries)) as server, template_directory(columns):
+        for name, options in (('phases', []), ('pipeline', ['--pipeline'])):
+            seconds, peak, _ = measure(lambda: gen_excel.main(
+                ['--key', 'fake', '--url', server.url, '--month', '6', '--year', '2020', '--engine', 'streaming',
+                 '--row-mode', row_mode, '--no-open-excel'] + options, standalone_mode=False), True)
+            click.echo('{0:>10}: {1:.3f}s, peak {2:.1f}MB'.format(name, seconds, peak))
+
+
+@benchmarks.command()
+@click.option("--loads", default=100, help="loads of the template, like a batch or a daemon does")
+def template(loads):
+    """Template setup without a cache, from the memory cache and from a cache directory"""
+    with template_directory(), tempfile.TemporaryDirectory() as cache_dir:
+        def parse():
+            adapter = ExcelAdapter('template.xlsx', 'template.xlsx')
+            with adapter.template_context():
+                WorkTable(adapter, None).parse()
+
+        def load_from_directory():
+            cache = TemplateCache()
+            cache.set_directory(cache_dir)
+            cache.load_row_plan('template.xlsx')
+
+        cache = TemplateCache()
+        load_from_directory()
+        for name, load in (('parse', parse), ('memory', lambda: cache.load_row_plan('template.xlsx')),
+                           ('directory', load_from_directory)):
+            started = time.perf_counter()
+            for i in range(loads):
+                load()
+            seconds = time.perf_counter() - started
+            click.echo('{0:>10}: {1:.3f}ms per load'.format(name, seconds / loads * 1000))
+
+
+@benchmarks.command()
+@click.option("--time-entries", default=100000, help="time entries of the period, one row each")
+def writers(time_entries):
+    """Rows per second of each output format, the rows are rendered once beforehand"""
+    with FakeRedmineServer(generate_dataset(time_entries)) as server, template_directory(DETAIL_TEMPLATE_COLUMNS):
+        row_plan = load_row_plan('template.xlsx')
+        with contextlib.redirect_stdout(io.StringIO()):
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020)
+            projects = redmine.get_projects()
+        rendered_rows = [row_plan.render(**dict(zip(row_modes['time_entry'], row)))
+                         for row in projects.get_rows('time_entry')]
+        adapters = [('xlsx ' + engine, adapter) for engine, adapter in excel_adapters.items()]
+        adapters.extend(table_adapters.items())
+        for name, adapter_class in adapters:
+            try:
+                adapter = adapter_class('template.xlsx', 'writers.xlsx')
+            except ValueError as e:
+                click.echo('{0:>15}: {1}'.format(name, e))
+                continue
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                WorkTable(adapter, None, row_plan=row_plan).process(rendered_rows=rendered_rows, open_excel=False)
+            seconds = time.perf_counter() - started
+            click.echo('{0:>15}: {1} rows in {2:.3f}s, {3:.0f} rows/s, {4:.0f}KB'.format(
+                name, len(rendered_rows), seconds, len(rendered_rows) / seconds,
+                os.path.getsize(adapter.target_file_path) / 2 ** 10))
+
+
+if __name__ == '__main__':
+    benchmarks()
@@ -0,0 +1,230 @@
+# -- coding: utf-8 --
+
+"""
+A tiny in-process Redmine look-alike used by the tests.
+
+It only implements the REST endpoints the exporter talks to and mimics the
+server side paging rules (``offset``/``limit`` with ``limit`` capped at 100).
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeRedmineData(object):
+    def __init__(self, projects=None, users=None, issues=None, time_entries=None):
+        self.projects = projects or []
+        self.users = users or []
+        self.issues = issues or []
+        self.time_entries = time_entries or []
+        self.current_user = self.users[0] if self.users else {
+            'id': 1, 'login': 'admin', 'firstname': 'Admin', 'lastname': 'Redmine'}
+
+    @staticmethod
+    def _by_id(items, uid):
+        for item in items:
+            if str(item['id']) == str(uid):
+                return item
+        return None
+
+    def get_project(self, uid):
+        for project in self.projects:
+            if str(project['id']) == str(uid) or project.get('identifier') == uid:
+                return project
+        return None
+
+    def get_user(self, uid):
+        if uid == 'current':
+            return self.current_user
+        return self._by_id(self.users, uid)
+
+    def get_children(self, uid):
+        return [{'id': project['id'], 'name': project['name']} for project in self.projects
+                if str(project.get('parent', {}).get('id')) == str(uid)]
+
+    def get_subtree_ids(self, uid):
+        uids = {uid}
+        for child in self.get_children(uid):
+            uids |= self.get_subtree_ids(child['id'])
+        return uids
+
+    def get_issue(self, uid):
+        return self._by_id(self.issues, uid)
+
+    @staticmethod
+    def filter_status(items, status, default):
+        """
+        like Redmine, only the items of the default status are listed unless `status` is given,
+        `*` or a blank status lists all of them
+        """
+        status = default if status is None else status
+        if status in ('*', ''):
+            return items
+        return [item for item in items if str(item.get('status', default)) == status]
+
+    @staticmethod
+    def is_updated(item, updated_on=None):
+        # only the `>=timestamp` form of the filter is supported
+        return updated_on is None or item.get('updated_on', '') >= updated_on[len('>='):]
+
+    def filter_issues(self, issue_id=None, updated_on=None):
+        issues = [issue for issue in self.issues if self.is_updated(issue, updated_on)]
+        if issue_id is None:
+            return issues
+        uids = set(issue_id.split(','))
+        return [issue for issue in issues if str(issue['id']) in uids]
+
+    #  {sort criterion: key}, the project and the user are sorted by name like Redmine does
+    sort_keys = {
+        'project': lambda entry: entry['project']['name'],
+        'user': lambda entry: entry['user']['name'],
+        'spent_on': lambda entry: entry['spent_on'],
+        'id': lambda entry: entry['id'],
+    }
+
+    def filter_time_entries(self, from_date=None, to_date=None, updated_on=None, sort=None, project_id=None,
+                            subproject_id=None):
+        project_ids = None
+        if project_id is not None:
+            # like Redmine, the sub projects are included unless `subproject_id=!*`
+            uid = self.get_project(project_id)['id']
+            project_ids = {uid} if subproject_id == '!*' else self.get_subtree_ids(uid)
+        time_entries = [entry for entry in self.time_entries
+                        if (from_date is None or entry['spent_on'] >= from_date) and
+                        (to_date is None or entry['spent_on'] <= to_date) and
+                        (project_ids is None or entry['project']['id'] in project_ids) and
+                        self.is_updated(entry, updated_on)]
+        if sort is None:
+            # Redmine's default ordering for time entries
+            time_entries.sort(key=lambda entry: (entry['spent_on'], entry['id']), reverse=True)
+            return time_entries
+        #  `sort=project,user:desc`, the last criterion is applied first
+        for criterion in reversed(sort.split(',')):
+            name, _, order = criterion.partition(':')
+            time_entries.sort(key=self.sort_keys[name], reverse=order == 'desc')
+        return time_entries
+
+
+def make_time_entry(uid, project, user, issue=None, hours=1.0, spent_on='2020-06-01'):
+    entry = {
+        'id': uid,
+        'project': {'id': project['id'], 'name': project['name']},
+        'user': {'id': user['id'], 'name': '{0} {1}'.format(user['firstname'], user['lastname'])},
+        'activity': {'id': 9, 'name': 'Development'},
+        'hours': hours,
+        'comments': '',
+        'spent_on': spent_on,
+        'created_on': '{0}T08:00:00Z'.format(spent_on),
+        'updated_on': '{0}T08:00:00Z'.format(spent_on),
+    }
+    if issue is not None:
+        entry['issue'] = {'id': issue['id']}
+    return entry
+
+
+class FakeRedmineHandler(BaseHTTPRequestHandler):
+    max_limit = 100
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def data(self) -> FakeRedmineData:
+        return self.server.data
+
+    def send_json(self, payload, status=200):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_not_found(self):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def paginate(self, items, container, query):
+        offset = int(query.get('offset', 0) or 0)
+        limit = min(int(query.get('limit', 25) or 25), self.max_limit)
+        self.send_json({container: items[offset:offset + limit],
+                        'total_count': len(items),
+                        'offset': offset,
+                        'limit': limit})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        parts = [part for part in url.path.split('/') if part]
+        with self.server.lock:
+            self.server.requests.append((url.path, query))
+        if parts == ['time_entries.json']:
+            items = self.data.filter_time_entries(query.get('from'), query.get('to'), query.get('updated_on'),
+                                                  query.get('sort'), query.get('project_id'),
+                                                  query.get('subproject_id'))
+            return self.paginate(items, 'time_entries', query)
+        if parts == ['issues.json']:
+            items = self.data.filter_issues(query.get('issue_id'), query.get('updated_on'))
+            return self.paginate(items, 'issues', query)
+        if parts == ['users.json']:
+            return self.paginate(self.data.filter_status(self.data.users, query.get('status'), '1'), 'users', query)
+        if parts == ['projects.json']:
+            return self.paginate(self.data.filter_status(self.data.projects, query.get('status'), '1'), 'projects',
+                                 query)
+        if len(parts) == 3 and parts[0] == 'projects' and parts[2] == 'children':
+            return self.send_json({'children': self.data.get_children(parts[1])})
+        if len(parts) == 2 and parts[1].endswith('.json'):
+            uid = parts[1][:-len('.json')]
+            resource = {
+                'projects': ('project', self.data.get_project),
+                'users': ('user', self.data.get_user),
+                'issues': ('issue', self.data.get_issue),
+            }.get(parts[0])
+            if resource is not None:
+                item = resource[1](uid)
+                if item is not None:
+                    return self.send_json({resource[0]: item})
+        return self.send_not_found()
+
+
+class FakeRedmineServer(object):
+    """
+    with FakeRedmineServer(data) as server:
+        RedmineAdapter(server.url, key='any', month=6)
+    """
+    def __init__(self, data: FakeRedmineData, handler=FakeRedmineHandler):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.data = data
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests = []
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.httpd.server_address[1])
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def count_requests(self, path):
+        return len([request for request in self.requests if request[0] == path])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
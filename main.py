@@ -1,31 +1,287 @@
 # -- coding: utf-8 --
 
+import abc
 import calendar
 import contextlib
+import csv
 import datetime
+import functools
+import hashlib
+import importlib.util
+import itertools
 import json
 import logging
+import multiprocessing
 import os
-from collections import OrderedDict
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from copy import copy
 from typing import Generator
 
 import click
-import requests
-from jinja2 import Template
-from lxml import html
-from openpyxl import load_workbook
-from redminelib import Redmine
-from win32com.client import Dispatch
+
+#  jinja2, openpyxl, redminelib, requests, lxml, aiohttp, pyarrow and win32com are imported where they are used,
+#  this keeps `--help` fast and the module importable without the Windows only packages
 
 
 logger = logging.getLogger(__name__)
-etree = html.etree
+missing = object()
+
+
+class Profiler(object):
+    """
+    wall time, HTTP requests and lazy fetches of each phase of a run, enabled with `--profile`.
+    requests and lazy fetches count for the innermost phase open in their thread when they happen,
+    the functions of worker threads are wrapped with `bind` to run in the phases of the submitting thread
+    """
+    def __init__(self):
+        self.enabled = False
+        self.phases = OrderedDict()
+        #  the stack of the open phases of each thread
+        self._local = threading.local()
+        #  guards the totals of `phases`
+        self._lock = threading.Lock()
+        self._started = None
+        self._stopped = None
+        self._cprofile = None
+
+    def start(self, cprofile=False):
+        self.enabled = True
+        self.phases.clear()
+        self._local = threading.local()
+        self._started = time.perf_counter()
+        self._stopped = None
+        if cprofile:
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._stopped = time.perf_counter()
+        self.enabled = False
+
+    @property
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def bind(self, function):
+        """
+        :return: the function running in the phases open in this thread, for the functions of worker threads
+        """
+        if not self.enabled:
+            return function
+        stack = list(self._stack)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            previous = getattr(self._local, 'stack', None)
+            self._local.stack = list(stack)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.stack = previous
+        return wrapper
+
+    def _get_phase(self, name):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = OrderedDict([('calls', 0), ('seconds', 0.0), ('requests', 0),
+                                                     ('bytes', 0), ('latency', 0.0), ('lazy_fetches', {})])
+        return phase
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            with self._lock:
+                phase = self._get_phase(name)
+                phase['calls'] += 1
+                phase['seconds'] += time.perf_counter() - started
+
+    def profiled(self, name):
+        """
+        decorator running the function in a phase
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _current_phase(self):
+        return self._get_phase(self._stack[-1] if self._stack else 'other')
+
+    def count_request(self, size, seconds):
+        if self.enabled:
+            with self._lock:
+                phase = self._current_phase()
+                phase['requests'] += 1
+                phase['bytes'] += size
+                phase['latency'] += seconds
+
+    def count_lazy_fetch(self, resource_name):
+        if self.enabled:
+            with self._lock:
+                lazy_fetches = self._current_phase()['lazy_fetches']
+                lazy_fetches[resource_name] = lazy_fetches.get(resource_name, 0) + 1
+
+    def on_response(self, response, *args, **kwargs):
+        """
+        `requests` response hook
+        """
+        if self.enabled:
+            self.count_request(len(response.content), response.elapsed.total_seconds())
+
+    def report(self):
+        phases = OrderedDict((name, dict(phase, seconds=round(phase['seconds'], 6),
+                                         latency=round(phase['latency'], 6)))
+                             for name, phase in self.phases.items())
+        return OrderedDict([
+            ('seconds', round((self._stopped or time.perf_counter()) - (self._started or 0), 6)),
+            ('requests', sum(phase['requests'] for phase in phases.values())),
+            ('bytes', sum(phase['bytes'] for phase in phases.values())),
+            ('lazy_fetches', sum(sum(phase['lazy_fetches'].values()) for phase in phases.values())),
+            ('phases', phases),
+        ])
+
+    def dump(self, path):
+        """
+        write the JSON report to `path` and the cProfile stats, if enabled, next to it as `.prof`
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.splitext(path)[0] + '.prof')
+            self._cprofile = None
+
+
+profiler = Profiler()
+
+
+class TimeEntryTable(object):
+    """
+    hours of the time entries attached to a Projects graph, kept column by column
+    so that the totals of any dimensions are computed in one vectorized pass
+    """
+    dimensions = ('project', 'user', 'task', 'activity', 'day')
+
+    def __init__(self):
+        self._columns = OrderedDict((dimension, []) for dimension in self.dimensions)
+        self._hours = []
+        self._arrays = None
+        self._totals = {}
+
+    def __len__(self):
+        return len(self._hours)
+
+    def append(self, key, values):
+        """
+        :param key: (project id, user id, task id)
+        :param values: raw data of the time entry
+        """
+        project_id, user_id, task_id = key
+        hours = values.get('hours')
+        spent_on = values.get('spent_on')
+        row = (project_id, user_id, task_id, (values.get('activity') or {}).get('id', 0),
+               datetime.date.fromisoformat(spent_on).toordinal() if spent_on else 0)
+        for column, value in zip(self._columns.values(), row):
+            column.append(value)
+        #  the same rule as the per object sum, only float hours count
+        self._hours.append(hours if isinstance(hours, float) else 0.0)
+        self._arrays = None
+        self._totals.clear()
+
+    def select(self, dimension, uids):
+        """
+        keep only the time entries whose `dimension` is one of `uids`
+        """
+        uids = set(uids)
+        kept = [i for i, uid in enumerate(self._columns[dimension]) if uid in uids]
+        for name, column in self._columns.items():
+            self._columns[name] = [column[i] for i in kept]
+        self._hours = [self._hours[i] for i in kept]
+        self._arrays = None
+        self._totals.clear()
+
+    def totals(self, *dimensions):
+        """
+        :param dimensions: names of `dimensions`
+        :return: {key: hours}, the key is a tuple of the dimension values, or the value of a single dimension
+        """
+        totals = self._totals.get(dimensions)
+        if totals is None:
+            totals = self._totals[dimensions] = self._group_by(dimensions)
+        return totals
+
+    def _get_arrays(self):
+        import numpy
+
+        if self._arrays is None:
+            self._arrays = dict((dimension, numpy.array(column, dtype=numpy.int64))
+                                for dimension, column in self._columns.items())
+            self._arrays['hours'] = numpy.array(self._hours, dtype=numpy.float64)
+        return self._arrays
+
+    def _group_by(self, dimensions):
+        import numpy
+
+        if not self._hours:
+            return {}
+        arrays = self._get_arrays()
+        columns = [arrays[dimension] for dimension in dimensions]
+        #  lexsort is stable, the last key is the primary one
+        order = numpy.lexsort(columns[::-1])
+        changed = numpy.zeros(len(order), dtype=bool)
+        for column in columns:
+            sorted_column = column[order]
+            changed[1:] |= sorted_column[1:] != sorted_column[:-1]
+        groups = numpy.cumsum(changed)
+        inverse = numpy.empty_like(groups)
+        inverse[order] = groups
+        #  bincount adds the hours in the order of the rows, the same order as the per object sum
+        hours = numpy.bincount(inverse, weights=arrays['hours'], minlength=groups[-1] + 1)
+        first_rows = order[numpy.concatenate(([0], numpy.flatnonzero(changed)))]
+        totals = OrderedDict()
+        for key, value in zip(zip(*[column[first_rows].tolist() for column in columns]), hours.tolist()):
+            key = tuple(datetime.date.fromordinal(uid) if dimension == 'day' and uid else uid
+                        for dimension, uid in zip(dimensions, key))
+            totals[key if len(key) > 1 else key[0]] = value
+        return totals
 
 
 class LocalResourceBase(object):
+    #  instances are created per project, user, task and time entry of the period, slots keep them small
+    __slots__ = ('name', 'uid', '_resources', '_redmine', '_cached_items', '_cached_remote_resource',
+                 '_time_entries', '_key')
+
     include_attributes = [
     ]
 
+    #  attributes copied out of the raw data of the remote resource, the others come from `cached_remote_resource`
+    local_attributes = (
+    )
+
     redmine_resource = None
 
     #  {attribute: redmine_custom_attribute}
@@ -36,14 +292,26 @@ class LocalResourceBase(object):
     def __init__(self, name: str, uid: int, resources: [], **kwargs):
         self.name = name
         self.uid = uid
-        self._resources = OrderedDict()
+        self._resources = None
         self.extend_resource(resources)
-        self._remote_resource = kwargs.pop('remote_resource', None)
+        self.copy_attributes(kwargs.pop('values', None) or {})
         self._redmine = kwargs.pop('redmine', None)
-        self._cached_items = {}
+        #  the TimeEntryTable of the graph and the uids from the root down to this resource
+        self._time_entries = kwargs.pop('time_entries', None)
+        self._key = kwargs.pop('key', ())
+        self._cached_items = None
         self._cached_remote_resource = None
 
+    def copy_attributes(self, values):
+        """
+        :param values: the raw data of the remote resource
+        """
+        for attribute in self.local_attributes:
+            setattr(self, attribute, values.get(attribute))
+
     def append_resource(self, resource):
+        if self._resources is None:
+            self._resources = OrderedDict()
         self._resources.update({resource.uid: resource})
 
     def extend_resource(self, resources):
@@ -51,67 +319,115 @@ class LocalResourceBase(object):
             self.append_resource(resource)
 
     def clear_resource(self):
-        self._resources = {}
+        self._resources = None
 
     @property
     def resources(self):
+        if self._resources is None:
+            return
         for key, val in self._resources.items():
             yield val
 
     def get_resource_by_uid(self, uid: int):
+        if self._resources is None:
+            return None
         return self._resources.get(uid)
 
-    def get_resource(self, remote_resource, cls):
-        resource = self.get_resource_by_uid(remote_resource.id)
+    def get_resource(self, values, cls):
+        """
+        :param values: raw data of the remote resource, e.g. {'id': 1, 'name': 'project1'}
+        :param cls: LocalResourceBase subclass
+        """
+        resource = self.get_resource_by_uid(values['id'])
         if resource is None:
             #  name is optional
-            resource = cls(getattr(remote_resource, 'name', None),
-                           remote_resource.id, [], remote_resource=remote_resource, redmine=self._redmine)
+            resource = cls(values.get('name'), values['id'], [], values=values, redmine=self._redmine,
+                           time_entries=self._time_entries, key=self._key + (values['id'],))
             self.append_resource(resource)
         return resource
 
+    @property
+    def id(self):
+        return self.uid
+
     def cache_data(self, attribute, data):
+        if self._cached_items is None:
+            self._cached_items = {}
         self._cached_items.update({attribute: data})
 
     def get_cached_data(self, attribute):
+        if self._cached_items is None:
+            return None
         return self._cached_items.get(attribute, None)
 
     def __getattr__(self, item):
-        value = getattr(self._remote_resource, item, None)
-        if value is None:
-            value = getattr(self.cached_remote_resource, item, None)
+        #  private and special names are never remote attributes, this also keeps copy and pickle
+        #  from recursing into here before the slots are set
+        if item.startswith('_'):
+            raise AttributeError(item)
+        value = getattr(self.cached_remote_resource, item, None)
         if value is None:
             value = self.get_custom_attributes(item)
         return value
 
+    def set_cached_remote_resource(self, remote_resource):
+        self._cached_remote_resource = remote_resource
+        self.cache_data('custom_fields', None)
+
     @property
     def cached_remote_resource(self):
         if self._cached_remote_resource is None:
             resource = getattr(self._redmine, self.redmine_resource, None)
             if resource is not None:
+                profiler.count_lazy_fetch(self.redmine_resource)
                 self._cached_remote_resource = resource.get(self.uid)
         return self._cached_remote_resource
 
+    def get_custom_fields(self):
+        """
+        :return: {custom field id or name: value}, built once from the remote resource
+        """
+        custom_fields = self.get_cached_data('custom_fields')
+        if custom_fields is None:
+            custom_fields = {}
+            for fields in getattr(self.cached_remote_resource, 'custom_fields', None) or []:
+                value = getattr(fields, 'value', None)
+                custom_fields[getattr(fields, 'id', None)] = value
+                custom_fields[getattr(fields, 'name', None)] = value
+            self.cache_data('custom_fields', custom_fields)
+        return custom_fields
+
     def get_custom_attributes(self, attribute):
         redmine_custom_attribute = self.custom_attributes.get(attribute, None)
         if redmine_custom_attribute is None or redmine_custom_attribute == '':
             return None
-        value = self.get_cached_data(redmine_custom_attribute)
-        if value is None:
-            for fields in self.cached_remote_resource.custom_fields:
-                if getattr(fields, 'name', None) == redmine_custom_attribute:
-                    value = getattr(fields, 'value', None)
-                    if value is not None:
-                        self.cache_data(redmine_custom_attribute, value)
-                        break
-        return value
+        #  fields that are missing or empty are answered by the index as well, without another search
+        return self.get_custom_fields().get(redmine_custom_attribute)
 
 
 class WorkTime(LocalResourceBase):
+    __slots__ = ('hours', 'spent_on', 'comments', 'activity', 'user', 'project', 'issue', 'created_on',
+                 'updated_on')
+
     redmine_resource = 'time_entry'
 
+    #  everything the time entries list returns, the references stay raw dicts like {'id': 9, 'name': 'Development'}
+    #  that Jinja reads as attributes. custom fields are fetched with one request per time entry
+    local_attributes = __slots__
+
+    def copy_attributes(self, values):
+        super(WorkTime, self).copy_attributes(values)
+        if self.spent_on is not None:
+            self.spent_on = datetime.date.fromisoformat(self.spent_on)
+        for attribute in ('created_on', 'updated_on'):
+            value = getattr(self, attribute)
+            if value is not None:
+                setattr(self, attribute, datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+
 
 class Task(LocalResourceBase):
+    __slots__ = ()
+
     redmine_resource = 'issue'
 
     include_attributes = [
@@ -126,10 +442,17 @@ class Task(LocalResourceBase):
         return self.resources
 
     def get_work_time(self, remote_work_time) -> WorkTime:
-        return super(Task, self).get_resource(remote_work_time, WorkTime)
+        work_time = self.get_resource_by_uid(remote_work_time['id'])
+        if work_time is None:
+            work_time = super(Task, self).get_resource(remote_work_time, WorkTime)
+            if self._time_entries is not None:
+                self._time_entries.append(self._key, remote_work_time)
+        return work_time
 
     @property
     def spent_time(self) -> float:
+        if self._time_entries is not None:
+            return self._time_entries.totals('project', 'user', 'task').get(self._key, 0)
         spent_time = self.get_cached_data('spent_time')
         if spent_time is None:
             spent_time = 0
@@ -142,6 +465,8 @@ class Task(LocalResourceBase):
 
 
 class User(LocalResourceBase):
+    __slots__ = ()
+
     redmine_resource = 'user'
 
     @property
@@ -153,6 +478,11 @@ class User(LocalResourceBase):
 
     @property
     def spent_time(self):
+        """
+        :return: person-days of 8 hours
+        """
+        if self._time_entries is not None:
+            return round(self._time_entries.totals('project', 'user').get(self._key, 0) / 8.0, 2)
         spent_time = self.get_cached_data('spent_time')
         if spent_time is None:
             spent_time = 0
@@ -168,6 +498,8 @@ class User(LocalResourceBase):
 
 
 class Project(LocalResourceBase):
+    __slots__ = ()
+
     redmine_resource = 'project'
 
     custom_attributes = {
@@ -185,7 +517,7 @@ class Project(LocalResourceBase):
     def get_user(self, remote_user) -> User:
         """
         get user instance
-        :param remote_user: remote user instance
+        :param remote_user: raw data of the remote user
         :return: User instance
         """
         return super(Project, self).get_resource(remote_user, User)
@@ -196,6 +528,8 @@ class Project(LocalResourceBase):
 
 
 class Users(LocalResourceBase):
+    __slots__ = ()
+
     def __init__(self, redmine):
         super(Users, self).__init__(None, None, [], redmine=redmine)
 
@@ -206,15 +540,28 @@ class Users(LocalResourceBase):
     def get_user(self, remote_user) -> User:
         """
         get user instance
-        :param remote_user: remote user instance
+        :param remote_user: raw data of the remote user
         :return: User instance
         """
         return super(Users, self).get_resource(remote_user, User)
 
 
 class Projects(LocalResourceBase):
+    __slots__ = ()
+
     def __init__(self, redmine):
-        super(Projects, self).__init__(None, None, [], redmine=redmine)
+        super(Projects, self).__init__(None, None, [], redmine=redmine, time_entries=TimeEntryTable())
+
+    @property
+    def time_entries(self) -> TimeEntryTable:
+        return self._time_entries
+
+    def get_totals(self, *dimensions):
+        """
+        hours of the time entries grouped by dimensions
+        :param dimensions: project, user, task, activity or day
+        """
+        return self._time_entries.totals(*dimensions)
 
     @property
     def projects(self) -> Generator[None, Project, None]:
@@ -223,7 +570,7 @@ class Projects(LocalResourceBase):
     def get_project(self, remote_project) -> Project:
         """
         get user instance
-        :param remote_project: remote project instance
+        :param remote_project: raw data of the remote project
         :return: Project instance
         """
         return super(Projects, self).get_resource(remote_project, Project)
@@ -231,6 +578,41 @@ class Projects(LocalResourceBase):
     def get_project_by_project_id(self, project_id):
         return super(Projects, self).get_resource_by_uid(project_id)
 
+    def append_resource(self, resource):
+        super(Projects, self).append_resource(resource)
+        self.cache_data('rows', None)
+
+    def clear_resource(self):
+        super(Projects, self).clear_resource()
+        self.cache_data('rows', None)
+
+    def get_rows(self, row_mode='user'):
+        """
+        the flat row table of a row mode, built in one pass and kept until projects or time entries are added
+        :param row_mode: a key of `row_modes`
+        :return: [(project, user, ...)] in the order of the projects, users, tasks and time entries
+        """
+        tables = self.get_cached_data('rows')
+        if tables is None or tables[0] != len(self._time_entries):
+            tables = (len(self._time_entries), {})
+            self.cache_data('rows', tables)
+        rows = tables[1].get(row_mode)
+        if rows is None:
+            rows = [(project,) for project in self.projects]
+            #  each level appends the users, tasks or time entries of the last resource of the rows
+            for level in range(1, len(row_modes[row_mode])):
+                rows = [row + (resource,) for row in rows for resource in row[-1].resources]
+            tables[1][row_mode] = rows
+        return rows
+
+
+#  {row mode: variables of the row context}, one row per project and user, per task or per time entry
+row_modes = OrderedDict([
+    ('user', ('project', 'current_user')),
+    ('task', ('project', 'current_user', 'task')),
+    ('time_entry', ('project', 'current_user', 'task', 'work_time')),
+])
+
 
 class CustomCell(object):
     def __init__(self, adapter, row_index, column_index):
@@ -253,6 +635,9 @@ class CustomCell(object):
 
 
 class ExcelAdapter(object):
+    #  cells of equal values can be merged
+    can_merge = True
+
     def __init__(self, source_name: str, target_name: str):
         source_file_path = os.path.join(os.getcwd(), source_name)
         target_path = os.path.join(os.getcwd(), 'work tables')
@@ -275,8 +660,12 @@ class ExcelAdapter(object):
     def get_cell(self, row_index=1, column_index=1, **kwargs):
         return CustomCell(self, row_index, column_index)
 
+    @property
+    def max_column(self):
+        return self.current_workbook.max_column
+
     def get_cells(self, row_index=1):
-        for column_index in range(1, 100):
+        for column_index in range(1, self.max_column + 1):
             text = self.get_text(row_index=row_index, column_index=column_index)
             if text is not None and text != '':
                 yield CustomCell(self, row_index, column_index)
@@ -287,33 +676,363 @@ class ExcelAdapter(object):
 
     @contextlib.contextmanager
     def context(self):
+        from openpyxl import load_workbook
+
         template_workbook = load_workbook(filename=self.source_file_path)
         self.current_workbook = template_workbook.active
         yield self
         if not self.error_flag:
-            template_workbook.save(self.target_file_path)
+            with profiler.phase('save'):
+                template_workbook.save(self.target_file_path)
+
+    @contextlib.contextmanager
+    def template_context(self):
+        """
+        read the template without writing the target file
+        """
+        from openpyxl import load_workbook
+
+        self.current_workbook = load_workbook(filename=self.source_file_path).active
+        yield self
 
     def set_error_flag(self):
         self.error_flag = True
 
     def open_excel_for_windows(self):
-        excel_app = Dispatch('Excel.Application')
-        excel_app.Visible = 1
-        excel_app.Workbooks.Open(self.target_file_path)
+        """
+        open the target file when Excel is installed, only on Windows
+        """
+        if sys.platform != 'win32':
+            return
+        try:
+            from win32com.client import Dispatch
+
+            excel_app = Dispatch('Excel.Application')
+            excel_app.Visible = 1
+            excel_app.Workbooks.Open(self.target_file_path)
+        except Exception as e:
+            logger.warning('Unable to open Excel: {0}'.format(repr(e)))
+
+
+class StreamingExcelAdapter(ExcelAdapter):
+    """
+    Write-only engine, rows are streamed to the target file instead of being kept in memory.
+    The header rows, styles, column widths and merged ranges are copied from the template,
+    WorkTable writes rows top down so a row is flushed as soon as a following row is written.
+    """
+    def __init__(self, source_name: str, target_name: str):
+        super(StreamingExcelAdapter, self).__init__(source_name, target_name)
+        self.template_sheet = None
+        self._sheet = None
+        self._flushed_row_index = 0
+        self._pending_rows = {}
+
+    def set_text(self, text, row_index=1, column_index=1):
+        if row_index <= self._flushed_row_index:
+            raise ValueError('Row {0} has already been written'.format(row_index))
+        self.flush(row_index - 1)
+        self._pending_rows.setdefault(row_index, {})[column_index] = text
+
+    def get_text(self, row_index=1, column_index=1):
+        pending_row = self._pending_rows.get(row_index, {})
+        if column_index in pending_row:
+            return pending_row[column_index]
+        return self.template_sheet.cell(column=column_index, row=row_index).value
+
+    @property
+    def max_column(self):
+        return max([self.template_sheet.max_column] + [column_index for row in self._pending_rows.values()
+                                                       for column_index in row])
+
+    def merge(self, src_cell: CustomCell, dst_cell: CustomCell):
+        from openpyxl.worksheet.cell_range import CellRange
+
+        self._sheet.merged_cells.add(CellRange(min_col=src_cell.column_index, min_row=src_cell.row_index,
+                                               max_col=dst_cell.column_index, max_row=dst_cell.row_index))
+
+    def _get_row(self, row_index):
+        from openpyxl.cell import WriteOnlyCell
+
+        values = self._pending_rows.pop(row_index, {})
+        cells = []
+        if row_index <= self.template_sheet.max_row:
+            for template_cell in self.template_sheet[row_index]:
+                cell = WriteOnlyCell(self._sheet, value=values.pop(template_cell.column, template_cell.value))
+                if template_cell.has_style:
+                    cell.font = copy(template_cell.font)
+                    cell.fill = copy(template_cell.fill)
+                    cell.border = copy(template_cell.border)
+                    cell.alignment = copy(template_cell.alignment)
+                    cell.protection = copy(template_cell.protection)
+                    cell.number_format = template_cell.number_format
+                cells.append(cell)
+        for column_index in sorted(values):
+            cells.extend([None] * (column_index - len(cells) - 1))
+            cells.append(values[column_index])
+        return cells
+
+    def flush(self, row_index):
+        """
+        stream all the rows up to row_index to the target file
+        """
+        while self._flushed_row_index < row_index:
+            self._flushed_row_index += 1
+            self._sheet.append(self._get_row(self._flushed_row_index))
+
+    @contextlib.contextmanager
+    def context(self):
+        from openpyxl import Workbook, load_workbook
+        from openpyxl.worksheet.cell_range import CellRange
+
+        template_workbook = load_workbook(filename=self.source_file_path)
+        self.template_sheet = template_workbook.active
+        workbook = Workbook(write_only=True)
+        self._sheet = workbook.create_sheet(title=self.template_sheet.title)
+        for key, dimension in self.template_sheet.column_dimensions.items():
+            self._sheet.column_dimensions[key].width = dimension.width
+        for key, dimension in self.template_sheet.row_dimensions.items():
+            self._sheet.row_dimensions[key].height = dimension.height
+        self._sheet.freeze_panes = self.template_sheet.freeze_panes
+        for merged_range in self.template_sheet.merged_cells.ranges:
+            self._sheet.merged_cells.add(CellRange(merged_range.coord))
+        yield self
+        if not self.error_flag:
+            self.flush(max([self.template_sheet.max_row] + list(self._pending_rows.keys())))
+            with profiler.phase('save'):
+                workbook.save(self.target_file_path)
+
+
+class TableAdapter(ExcelAdapter, metaclass=abc.ABCMeta):
+    """
+    Writes the values of the rows without the styles of the template, for the tools that only read the data.
+    The header is the first row of the template, cells are not merged so a merged column repeats its value.
+    Rows are written in batches to a `.part` file, renamed to the target file when all of them are written.
+    """
+    extension = None
+    can_merge = False
+    batch_size = 1000
+
+    def __init__(self, source_name: str, target_name: str):
+        super(TableAdapter, self).__init__(source_name, os.path.splitext(target_name)[0] + self.extension)
+        self.template_sheet = None
+        self.header = []
+        self._file = None
+        self._row_index = None
+        self._row = []
+        self._rows = []
+
+    def set_text(self, text, row_index=1, column_index=1):
+        if self._row_index is not None and row_index < self._row_index:
+            raise ValueError('Row {0} has already been written'.format(row_index))
+        if row_index != self._row_index:
+            self.flush_row()
+            self._row_index = row_index
+        self._row.extend([None] * (column_index - len(self._row)))
+        self._row[column_index - 1] = text
+
+    def get_text(self, row_index=1, column_index=1):
+        if row_index == self._row_index and column_index <= len(self._row):
+            return self._row[column_index - 1]
+        return self.template_sheet.cell(column=column_index, row=row_index).value
+
+    @property
+    def max_column(self):
+        return self.template_sheet.max_column
+
+    def merge(self, src_cell: CustomCell, dst_cell: CustomCell):
+        raise ValueError('Cells can\'t be merged in a {0} file'.format(self.extension))
+
+    @staticmethod
+    def get_unique_header(names):
+        """
+        the names of the columns are the keys of the JSON objects and the Parquet fields,
+        a repeated name gets a suffix so that no column is lost: name, name_2, name_3
+        """
+        header = []
+        used = set(names)
+        counts = {}
+        for name in names:
+            if name in counts:
+                unique_name = name
+                while unique_name in used:
+                    counts[name] += 1
+                    unique_name = '{0}_{1}'.format(name, counts[name])
+                used.add(unique_name)
+                name = unique_name
+            else:
+                counts[name] = 1
+            header.append(name)
+        return header
+
+    def flush_row(self):
+        if not self._row:
+            return
+        self._rows.append(self._row + [None] * (len(self.header) - len(self._row)))
+        self._row = []
+        if len(self._rows) >= self.batch_size:
+            self.write_rows(self._rows)
+            self._rows = []
+
+    @abc.abstractmethod
+    def open(self, path):
+        """
+        open the target file and write the header
+        """
+
+    @abc.abstractmethod
+    def write_rows(self, rows):
+        """
+        write a batch of rows, lists of the values of the columns
+        """
+
+    def close(self):
+        self._file.close()
+
+    @contextlib.contextmanager
+    def context(self):
+        from openpyxl import load_workbook
+        from openpyxl.utils import get_column_letter
+
+        self.template_sheet = load_workbook(filename=self.source_file_path).active
+        names = []
+        for column_index in range(1, self.max_column + 1):
+            value = self.get_text(row_index=1, column_index=column_index)
+            #  a blank header cell is named by its column letter
+            names.append(get_column_letter(column_index) if value is None or value == '' else str(value))
+        self.header = self.get_unique_header(names)
+        part_path = self.target_file_path + '.part'
+        self.open(part_path)
+        try:
+            yield self
+            if not self.error_flag:
+                self.flush_row()
+                with profiler.phase('save'):
+                    if self._rows:
+                        self.write_rows(self._rows)
+                        self._rows = []
+                    self.close()
+                os.replace(part_path, self.target_file_path)
+        finally:
+            if os.path.exists(part_path):
+                self.close()
+                os.remove(part_path)
+
+    def open_excel_for_windows(self):
+        pass
+
+
+class CsvAdapter(TableAdapter):
+    """
+    UTF-8 with a byte order mark, so Excel reads the Chinese text as well
+    """
+    extension = '.csv'
+
+    def open(self, path):
+        self._file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.header)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    open_excel_for_windows = ExcelAdapter.open_excel_for_windows
+
+
+class JsonLinesAdapter(TableAdapter):
+    """
+    one JSON object per row, keyed by the header
+    """
+    extension = '.jsonl'
+
+    def open(self, path):
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write_rows(self, rows):
+        self._file.write(''.join(json.dumps(dict(zip(self.header, row)), ensure_ascii=False) + '\n'
+                                 for row in rows))
+
+
+class ParquetAdapter(TableAdapter):
+    """
+    one string column per column of the template, every batch of rows is a row group
+    """
+    extension = '.parquet'
+    batch_size = 10000
+
+    def __init__(self, source_name: str, target_name: str):
+        if importlib.util.find_spec('pyarrow') is None:
+            raise ValueError('The parquet format requires pyarrow, install it with `pip install pyarrow`')
+        super(ParquetAdapter, self).__init__(source_name, target_name)
+        self._schema = None
+
+    def open(self, path):
+        import pyarrow
+        import pyarrow.parquet
+
+        self._schema = pyarrow.schema([(name, pyarrow.string()) for name in self.header])
+        self._file = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write_rows(self, rows):
+        import pyarrow
+
+        columns = [pyarrow.array(values, type=pyarrow.string()) for values in zip(*rows)]
+        self._file.write_table(pyarrow.Table.from_arrays(columns, schema=self._schema))
+
+
+excel_adapters = OrderedDict([
+    ('memory', ExcelAdapter),
+    ('streaming', StreamingExcelAdapter),
+])
+
+table_adapters = OrderedDict([
+    ('csv', CsvAdapter),
+    ('jsonl', JsonLinesAdapter),
+    ('parquet', ParquetAdapter),
+])
+
+output_formats = ['xlsx'] + list(table_adapters.keys())
+
+
+def get_output_adapter(engine='memory', output_format='xlsx'):
+    """
+    :param engine: a key of `excel_adapters`, the engine writing the xlsx files
+    :param output_format: one of `output_formats`
+    :return: the adapter class
+    """
+    if output_format == 'xlsx':
+        return excel_adapters[engine]
+    return table_adapters[output_format]
+
+
+class MergeRun(object):
+    """
+    consecutive rows of a column holding the same value
+    """
+    def __init__(self, row, column, data):
+        self.start_row = row
+        self.last_row = row
+        self.column = column
+        self.data = data
 
 
 class WorkTable(object):
     def __init__(self, adapter: ExcelAdapter, projects: [],
-                 start_row: int = 2, start_column: int = 1, enable_merge=True):
+                 start_row: int = 2, start_column: int = 1, enable_merge=True, row_plan=None, row_mode='user'):
+        """
+        :param row_plan: the RowPlan of the template when it has been parsed already
+        :param row_mode: a key of `row_modes`, what each row of the sheet is
+        """
         self.adapter = adapter
+        self.row_plan = row_plan
+        self.row_variables = row_modes[row_mode]
         self.start_row = start_row
         self.start_column = start_column
         self.column_count = 0
         self.row_count = 0
         self._columns = []
-        self._rows = self.pre_process(projects)
+        self._rows = self.pre_process(projects, row_mode)
         self._cached_data = []
-        self.enable_merge = enable_merge
+        self.enable_merge = enable_merge and adapter.can_merge
 
     def parse(self):
         columns = []
@@ -323,19 +1042,15 @@ class WorkTable(object):
                                          first_row_cell.get_text(),
                                          second_row_cell.get_text(),
                                          self.adapter))
-        return columns
+        return RowPlan(columns)
 
     def render(self, *args, **context):
+        self.write_row(self._columns.render(**context))
+
+    def write_row(self, values):
         self.column_count = 0
-        for column in self._columns:
-            can_merge = False
-            if column.can_render():
-                if column.can_merge() and self.enable_merge:
-                    can_merge = True
-                data = column.render(*args, **context)
-            else:
-                data = column.get_text()
-            self.write(can_merge, data)
+        for can_merge, data in zip(self._columns.merges, values):
+            self.write(can_merge and self.enable_merge, data)
             self.column_count += 1
         self.row_count += 1
 
@@ -348,66 +1063,65 @@ class WorkTable(object):
         return self.start_row + self.row_count
 
     def _has_equal_cached_data(self, data):
-        if not self._cached_data[self.column_count]:
-            return False
-
-        for key, value in self._cached_data[self.column_count].items():
-            if value[1] != data:
-                return False
-
-        return True
+        run = self._cached_data[self.column_count]
+        return run is not None and run.data == data
 
     def merge_cur_column_cells(self):
-        current_data = self._cached_data[self.column_count]
-        self.merge_cells(current_data, self.column_count)
-
-    def merge_cells(self, current_data, column_index):
-        columns = list(current_data.items())
-        if current_data and len(columns) >= 2:
-            current_column = columns[0][1][0]
-            current_row = columns[0][0]
-            src_cell = self.adapter.get_cell(current_row, current_column)
-            dst_cell = self.adapter.get_cell(columns[-1][0], current_column)
-            self.adapter.set_text(columns[0][1][1], row_index=current_row, column_index=current_column)
+        self.merge_cells(self._cached_data[self.column_count], self.column_count)
+
+    def merge_cells(self, run, column_index):
+        if run is not None and run.last_row > run.start_row:
+            src_cell = self.adapter.get_cell(run.start_row, run.column)
+            dst_cell = self.adapter.get_cell(run.last_row, run.column)
             self.adapter.merge(src_cell, dst_cell)
-            self._cached_data[column_index] = OrderedDict()
-        elif current_data and len(columns) == 1:
-            current_column = columns[0][1][0]
-            current_row = columns[0][0]
-            self.adapter.set_text(columns[0][1][1], row_index=current_row, column_index=current_column)
-            self._cached_data[column_index] = OrderedDict()
+        self._cached_data[column_index] = None
 
+    @profiler.profiled('merge_all_cells')
     def merge_all_cells(self):
-        for i, data in enumerate(self._cached_data):
-            self.merge_cells(data, i)
+        for i, run in enumerate(self._cached_data):
+            self.merge_cells(run, i)
 
     def write(self, can_merge: bool, data: str, **context):
         if can_merge:
-            if not self._has_equal_cached_data(data):
+            if self._has_equal_cached_data(data):
+                self._cached_data[self.column_count].last_row = self.current_row
+            else:
                 self.merge_cur_column_cells()
-            self._cached_data[self.column_count].update(
-                {self.current_row: (self.current_column, data)}
-            )
+                #  the value belongs to the first cell of the run, written now so rows can be streamed
+                self.adapter.set_text(data, row_index=self.current_row, column_index=self.current_column)
+                self._cached_data[self.column_count] = MergeRun(self.current_row, self.current_column, data)
         else:
             self.adapter.set_text(data, row_index=self.current_row, column_index=self.current_column)
 
     @staticmethod
-    def pre_process(projects: [Project]):
-        for project in projects.projects:
-            for user in project.users:
-                yield (project, user)
+    def pre_process(projects: Projects, row_mode='user'):
+        """
+        :return: the rows of the row mode, tuples of the values of `row_modes[row_mode]`
+        """
+        if projects is None:
+            return []
+        return projects.get_rows(row_mode)
 
-    def process(self):
+    def process(self, rendered_rows=None, open_excel=True):
+        """
+        :param rendered_rows: the values of the rows rendered beforehand,
+                              by default the rows are rendered from the projects
+        :param open_excel: open the generated file with Excel
+        """
         error_flag = True
         click.echo('Step three: Generating Excel,please waiting....')
         with self.adapter.context():
-            self._columns = self.parse()
-            self._cached_data.extend([OrderedDict() for i in self._columns])
+            self._columns = self.row_plan if self.row_plan is not None else self.parse()
+            self._cached_data.extend([None for i in self._columns])
             try:
-                with click.progressbar(self._rows) as bar:
-                    for project, user in bar:
+                with profiler.phase('render'), \
+                        click.progressbar(self._rows if rendered_rows is None else rendered_rows) as bar:
+                    for row in bar:
                         error_flag = False
-                        self.render(project=project, current_user=user)
+                        if rendered_rows is None:
+                            self.render(**dict(zip(self.row_variables, row)))
+                        else:
+                            self.write_row(row)
                 self.merge_all_cells()
                 if error_flag:
                     self.adapter.set_error_flag()
@@ -420,22 +1134,73 @@ class WorkTable(object):
         else:
             click.echo('Successfully generated, please open `{0}` file under the `work table` dir'.
                        format(self.adapter.target_name))
-            self.adapter.open_excel_for_windows()
+            if open_excel:
+                self.adapter.open_excel_for_windows()
 
 
 class ColumnRawData(object):
+    #  column kinds, see `classify`
+    CONSTANT = 'constant'
+    PATH = 'path'
+    TEMPLATE = 'template'
+
     def __init__(self, column_id, field_text, render_text, adapter):
         self.column_id = column_id
         self.field_text = field_text
         self.render_text = render_text
-        self.template = Template(render_text)
+        self.template = template_cache.get_template(render_text)
         self.adapter = adapter
+        self._can_render = '{{' in self.render_text
+        self._can_merge = 'merge' in self.render_text
+        self.path = None
+        self.kind = self.classify()
 
     def can_render(self):
-        return '{{' in self.render_text
+        return self._can_render
 
     def can_merge(self):
-        return 'merge' in self.render_text
+        return self._can_merge
+
+    def classify(self):
+        """
+        constant: written as it is
+        path: a single `{{ name.attribute... }}` expression, resolved without Jinja
+        template: anything else, rendered by Jinja
+        """
+        from jinja2 import nodes
+
+        if not self._can_render:
+            return self.CONSTANT
+        body = self.template.environment.parse(self.render_text).body
+        if len(body) == 1 and isinstance(body[0], nodes.Output) and len(body[0].nodes) == 1:
+            path = []
+            node = body[0].nodes[0]
+            while isinstance(node, nodes.Getattr):
+                path.insert(0, node.attr)
+                node = node.node
+            if isinstance(node, nodes.Name):
+                self.path = [node.name] + path
+                return self.PATH
+        return self.TEMPLATE
+
+    def resolve(self, context):
+        """
+        resolve a path column the way Jinja does, the template is rendered when the path
+        can't be resolved so that undefined values behave exactly the same
+        """
+        from jinja2 import Undefined
+
+        environment = self.template.environment
+        value = context.get(self.path[0], missing)
+        for attribute in self.path[1:]:
+            if value is missing:
+                break
+            value = environment.getattr(value, attribute)
+            if isinstance(value, Undefined):
+                value = missing
+        if value is missing:
+            return self.render(**context)
+        return str(value)
 
     def render(self, *args, **context):
         return self.template.render(*args, **context)
@@ -444,23 +1209,548 @@ class ColumnRawData(object):
         return self.render_text
 
 
+class RowPlan(object):
+    """
+    The columns of a WorkTable compiled once: constant columns are precomputed,
+    path columns are resolved directly and the remaining columns are rendered
+    together by one Jinja template per row.
+    """
+    separator = '\x00\x1f\x00'
+
+    def __init__(self, columns: [ColumnRawData]):
+        self.columns = columns
+        self.merges = [column.can_render() and column.can_merge() for column in columns]
+        self._template_columns = [column for column in columns if column.kind == ColumnRawData.TEMPLATE]
+        #  every column gets its own scope, so `set` statements don't leak between columns
+        self._template = template_cache.get_template(self.separator.join(
+            '{{% with %}}{0}{{% endwith %}}'.format(self._strip_trailing_newline(column.render_text))
+            for column in self._template_columns))
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    @staticmethod
+    def _strip_trailing_newline(render_text):
+        #  Jinja drops a single trailing newline of each template source
+        if render_text.endswith('\r\n'):
+            return render_text[:-2]
+        if render_text.endswith('\n'):
+            return render_text[:-1]
+        return render_text
+
+    def _render_templates(self, context):
+        if not self._template_columns:
+            return []
+        values = self._template.render(**context).split(self.separator)
+        if len(values) != len(self._template_columns):
+            #  the separator is part of the rendered data
+            values = [column.render(**context) for column in self._template_columns]
+        return values
+
+    @property
+    def sources(self):
+        """
+        :return: ((field text, render text),) of the columns, a RowPlan is compiled again from them
+        """
+        return tuple((column.field_text, column.render_text) for column in self.columns)
+
+    @classmethod
+    def from_sources(cls, sources):
+        return cls([ColumnRawData(column_index, field_text, render_text, None)
+                    for column_index, (field_text, render_text) in enumerate(sources, 1)])
+
+    def render(self, **context):
+        """
+        :return: the values of one row
+        """
+        template_values = iter(self._render_templates(context))
+        values = []
+        for column in self.columns:
+            if column.kind == ColumnRawData.CONSTANT:
+                values.append(column.get_text())
+            elif column.kind == ColumnRawData.PATH:
+                values.append(column.resolve(context))
+            else:
+                values.append(next(template_values))
+        return values
+
+
+class TemplateCache(object):
+    """
+    The RowPlans of the template files, kept by path, modification time and size, and by the hash of the
+    content so that a copied or touched template is not parsed again. The Jinja templates of the columns
+    are compiled once per process, with a directory the column layouts and the Jinja bytecode are also
+    kept on disk between runs.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        #  {path: ((modification time, size), RowPlan)}
+        self._row_plans = {}
+        #  {content hash: RowPlan sources}
+        self._sources = {}
+        self._environment = None
+
+    def set_directory(self, directory):
+        """
+        :param directory: where the column layouts and the bytecode are kept, None to only keep them in memory
+        """
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._environment = None
+
+    @property
+    def environment(self):
+        if self._environment is None:
+            from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader
+
+            #  the source is the name of the template, so Jinja's own cache compiles each source once
+            self._environment = Environment(
+                loader=FunctionLoader(lambda source: source),
+                bytecode_cache=FileSystemBytecodeCache(self.directory) if self.directory is not None else None)
+        return self._environment
+
+    def get_template(self, source):
+        """
+        :return: the compiled jinja Template of the source
+        """
+        return self.environment.get_template(source)
+
+    def _get_layout_path(self, digest):
+        return os.path.join(self.directory, 'template-{0}.json'.format(digest))
+
+    def _load_sources(self, digest):
+        sources = self._sources.get(digest)
+        if sources is None and self.directory is not None and os.path.exists(self._get_layout_path(digest)):
+            with open(self._get_layout_path(digest), encoding='utf-8') as f:
+                sources = self._sources[digest] = tuple(tuple(source) for source in json.load(f))
+        return sources
+
+    def _save_sources(self, digest, sources):
+        self._sources[digest] = sources
+        if self.directory is not None:
+            with open(self._get_layout_path(digest), 'w', encoding='utf-8') as f:
+                json.dump(sources, f, ensure_ascii=False)
+
+    def load_row_plan(self, source_name):
+        """
+        :param source_name: path of the template file
+        :return: the RowPlan of the template, parsed only when the file is new or changed
+        """
+        path = os.path.abspath(source_name)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._row_plans.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        sources = self._load_sources(digest)
+        if sources is None:
+            adapter = ExcelAdapter(source_name, source_name)
+            with adapter.template_context():
+                row_plan = WorkTable(adapter, None).parse()
+            self._save_sources(digest, row_plan.sources)
+        else:
+            row_plan = RowPlan.from_sources(sources)
+        self._row_plans[path] = (version, row_plan)
+        return row_plan
+
+
+template_cache = TemplateCache()
+
+
+class FetchPlan(object):
+    """
+    The remote resources the templates of a WorkTable need, found from the attributes they read.
+    Attributes the local objects answer by themselves need nothing, any other attribute of a project,
+    user, task or work time needs that kind of resource to be prefetched.
+    """
+    #  {kind: (redmine resource, attributes answered without the remote resource)}
+    kinds = OrderedDict([
+        ('project', ('project', frozenset(['name', 'uid', 'id', 'users']))),
+        ('user', ('user', frozenset(['name', 'uid', 'id', 'tasks', 'spent_time']))),
+        ('task', ('issue', frozenset(['uid', 'id', 'work_times', 'spent_time']))),
+        ('work_time', ('time_entry', frozenset(['uid', 'id'] + list(WorkTime.local_attributes)))),
+    ])
+    #  {(kind, attribute): kind of the items}
+    collections = {
+        ('project', 'users'): 'user',
+        ('user', 'tasks'): 'task',
+        ('task', 'work_times'): 'work_time',
+    }
+    #  {variable of the row context: kind}
+    variables = {
+        'project': 'project',
+        'current_user': 'user',
+        'task': 'task',
+        'work_time': 'work_time',
+    }
+    #  {filter that reads no attribute of the items: whether it returns the items}
+    item_filters = {
+        'list': True,
+        'length': False,
+        'count': False,
+    }
+    #  the value is used as a whole, e.g. given to a filter, any attribute may be read
+    ANY = '*'
+
+    def __init__(self, row_mode='user'):
+        """
+        :param row_mode: a key of `row_modes`, only its variables are in the row context
+        """
+        self.attributes = OrderedDict((kind, set()) for kind in self.kinds)
+        self.scope = dict((variable, self.variables[variable]) for variable in row_modes[row_mode])
+
+    @property
+    def resources(self):
+        """
+        :return: names of the redmine resources to prefetch
+        """
+        return set(resource for kind, (resource, local_attributes) in self.kinds.items()
+                   if self.attributes[kind] - local_attributes)
+
+    @classmethod
+    def from_row_plan(cls, row_plan, row_mode='user'):
+        fetch_plan = cls(row_mode)
+        for column in row_plan:
+            if column.can_render():
+                fetch_plan.add_template(column.template.environment.parse(column.render_text))
+        return fetch_plan
+
+    def add_template(self, template):
+        """
+        :param template: the parsed jinja template
+        """
+        self._visit(template, dict(self.scope))
+
+    def _read(self, kind, attribute):
+        if isinstance(kind, str):
+            self.attributes[kind].add(attribute)
+            items = self.collections.get((kind, attribute))
+            return None if items is None else ('items', items)
+        self._read_all(kind)
+        return None
+
+    def _read_all(self, kind):
+        if isinstance(kind, str):
+            self.attributes[kind].add(self.ANY)
+        elif kind is not None:
+            self.attributes[kind[1]].add(self.ANY)
+
+    def _visit(self, node, scope):
+        """
+        record the attributes read below `node`
+        :param scope: {variable name: kind}
+        :return: the kind of the value, ('items', kind) for a collection or None
+        """
+        from jinja2 import nodes
+
+        if isinstance(node, nodes.Name):
+            return scope.get(node.name) if node.ctx == 'load' else None
+        if isinstance(node, nodes.Getattr):
+            return self._read(self._visit(node.node, scope), node.attr)
+        if isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+            return self._read(self._visit(node.node, scope), node.arg.value)
+        if isinstance(node, nodes.Filter) and node.name in self.item_filters and node.node is not None and \
+                not node.args and not node.kwargs:
+            items = self._visit(node.node, scope)
+            return items if self.item_filters[node.name] else None
+        if isinstance(node, nodes.For):
+            items = self._visit(node.iter, scope)
+            body_scope = dict(scope)
+            if isinstance(node.target, nodes.Name):
+                body_scope[node.target.name] = items[1] if isinstance(items, tuple) else None
+            for child in node.body + ([node.test] if node.test is not None else []):
+                self._read_all(self._visit(child, body_scope))
+            for child in node.else_:
+                self._read_all(self._visit(child, scope))
+            return None
+        if isinstance(node, nodes.Assign) and isinstance(node.target, nodes.Name):
+            scope[node.target.name] = self._visit(node.node, scope)
+            return None
+        for child in node.iter_child_nodes():
+            self._read_all(self._visit(child, scope))
+        return None
+
+
+def snapshot_value(value):
+    """
+    :return: the value without python-redmine resources, those are replaced by their raw data,
+             Jinja reads the keys of a dict as attributes
+    """
+    from redminelib.resources import BaseResource
+    from redminelib.resultsets import BaseResourceSet
+
+    if isinstance(value, BaseResource):
+        return value.raw()
+    if isinstance(value, BaseResourceSet):
+        return [resource.raw() for resource in value]
+    if isinstance(value, (list, tuple)):
+        return [snapshot_value(item) for item in value]
+    return value
+
+
+class Snapshot(object):
+    """
+    A pickle friendly copy of a project, user, task or work time holding the attributes a FetchPlan reads,
+    rendered by worker processes in place of the live objects
+    """
+    def __getattr__(self, item):
+        #  unknown attributes are None, the same as for the live objects
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return None
+
+    @classmethod
+    def create(cls, resource, kind, fetch_plan, snapshots):
+        """
+        :param resource: LocalResourceBase instance
+        :param kind: the FetchPlan kind of the resource
+        :param snapshots: {id(resource): Snapshot} of the snapshots made so far, each resource is copied once
+        """
+        snapshot = snapshots.get(id(resource))
+        if snapshot is not None:
+            return snapshot
+        snapshot = snapshots[id(resource)] = cls()
+        attributes = set(fetch_plan.attributes[kind])
+        if FetchPlan.ANY in attributes:
+            #  any attribute may be read, copy all the remote data and the computed attributes
+            attributes.discard(FetchPlan.ANY)
+            attributes.update(['name', 'uid', 'id'])
+            attributes.update(type(resource).custom_attributes)
+            for klass in type(resource).__mro__[:type(resource).__mro__.index(LocalResourceBase)]:
+                attributes.update(name for name, value in vars(klass).items()
+                                  if isinstance(value, property) and not name.startswith('_'))
+            remote_resource = resource.cached_remote_resource
+            if remote_resource is not None:
+                snapshot.__dict__.update((key, snapshot_value(getattr(remote_resource, key)))
+                                         for key in list(remote_resource.raw()))
+        for attribute in attributes:
+            value = getattr(resource, attribute)
+            items_kind = fetch_plan.collections.get((kind, attribute))
+            if items_kind is not None:
+                value = [cls.create(item, items_kind, fetch_plan, snapshots) for item in value]
+            else:
+                value = snapshot_value(value)
+            setattr(snapshot, attribute, value)
+        return snapshot
+
+
 class CustomRemoteProject(object):
     def __init__(self, id, name):
         self.id = id
         self.name = name
 
+    def __eq__(self, other):
+        return isinstance(other, CustomRemoteProject) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class EntityStore(object):
+    """
+    Local sqlite copy of the Redmine entities. Every row is keyed by resource name and id and keeps
+    the raw json together with `updated_on`, `spent_on` (time entries) and when it was synced.
+    """
+    #  subtracted from the sync time to tolerate clock drift between us and the server
+    sync_margin = datetime.timedelta(minutes=5)
+    #  ids of one `IN` filter, below the 999 variables sqlite allows in a statement
+    select_chunk_size = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS entities (
+                    resource TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    updated_on TEXT,
+                    spent_on TEXT,
+                    synced_on TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (resource, id)
+                );
+                CREATE INDEX IF NOT EXISTS entities_spent_on ON entities (resource, spent_on);
+                CREATE TABLE IF NOT EXISTS project_trees (
+                    id INTEGER PRIMARY KEY,
+                    synced_on TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS syncs (
+                    key TEXT PRIMARY KEY,
+                    synced_on TEXT NOT NULL
+                );
+            """)
+
+    def now(self):
+        now = datetime.datetime.now(datetime.timezone.utc) - self.sync_margin
+        return now.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def save(self, resource_name, remote_resources, synced_on):
+        rows = []
+        for remote_resource in remote_resources:
+            data = remote_resource.raw()
+            rows.append((resource_name, data['id'], data.get('updated_on'), data.get('spent_on'),
+                         synced_on, json.dumps(data)))
+        with self._lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def delete(self, resource_name, uids):
+        with self._lock, self.connection:
+            self.connection.executemany('DELETE FROM entities WHERE resource = ? AND id = ?',
+                                        [(resource_name, uid) for uid in uids])
+
+    def _select(self, sql, *params):
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def load(self, resource_name, uids=None):
+        """
+        :param uids: ids of the entities, None for all the entities of the resource
+        :return: {id: (synced_on, raw data)} ordered by id
+        """
+        if uids is None:
+            rows = self._select('SELECT id, synced_on, data FROM entities WHERE resource = ? ORDER BY id',
+                                resource_name)
+        else:
+            uids = sorted(set(uids))
+            rows = []
+            for i in range(0, len(uids), self.select_chunk_size):
+                chunk = uids[i:i + self.select_chunk_size]
+                rows.extend(self._select('SELECT id, synced_on, data FROM entities WHERE resource = ? AND id IN ({0}) '
+                                         'ORDER BY id'.format(', '.join('?' * len(chunk))), resource_name, *chunk))
+        return OrderedDict((uid, (synced_on, json.loads(data))) for uid, synced_on, data in rows)
+
+    def load_time_entries(self, from_date, to_date):
+        rows = self._select('SELECT data FROM entities WHERE resource = ? AND spent_on BETWEEN ? AND ? '
+                            'ORDER BY id', 'time_entry', from_date, to_date)
+        return [json.loads(row[0]) for row in rows]
+
+    def get_time_entry_ids(self, from_date, to_date):
+        rows = self._select('SELECT id FROM entities WHERE resource = ? AND spent_on BETWEEN ? AND ?',
+                            'time_entry', from_date, to_date)
+        return {row[0] for row in rows}
+
+    def load_project_tree(self, project_id, synced_after):
+        """
+        :return: {project id: [CustomRemoteProject]} synced after `synced_after` or None
+        """
+        rows = self._select('SELECT data FROM project_trees WHERE id = ? AND synced_on > ?', project_id, synced_after)
+        if not rows:
+            return None
+        return {int(uid): [CustomRemoteProject(*child) for child in children]
+                for uid, children in json.loads(rows[0][0]).items()}
+
+    def save_project_tree(self, project_id, children, synced_on):
+        data = json.dumps({uid: [(child.id, child.name) for child in sub_projects]
+                           for uid, sub_projects in children.items()})
+        with self._lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO project_trees VALUES (?, ?, ?)',
+                                    (project_id, synced_on, data))
+
+    def get_synced_on(self, key):
+        rows = self._select('SELECT synced_on FROM syncs WHERE key = ?', key)
+        return rows[0][0] if rows else None
+
+    def set_synced_on(self, key, synced_on):
+        with self._lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?)', (key, synced_on))
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def page_offsets(total_count, first_page_size, page_size):
+    """
+    the pages of a list after its first page, the server may cap the limit below the requested page size
+    and the first page tells the limit it applies
+    :param first_page_size: number of items of the first page
+    :param page_size: the limit requested for the first page
+    :return: limit, offsets of the remaining pages
+    """
+    limit = first_page_size or page_size
+    return limit, range(first_page_size, total_count, limit)
+
 
 class RedmineAdapter(object):
+    #  the largest `limit` accepted by the Redmine REST API
+    page_size = 100
+    #  how long a sub project tree is taken from the local store
+    project_tree_max_age = datetime.timedelta(days=1)
+    #  periods with more pages are paginated in sub periods of `split_days` days
+    max_period_pages = 20
+    split_days = 7
+    #  seconds to connect and to wait for a response
+    timeout = (10, 60)
+    #  retries of each request after a connection error, a timeout or one of `retry_statuses`,
+    #  waiting `backoff_factor` * 2 ** (n - 1) seconds before the n-th retry but the first
+    retries = 3
+    backoff_factor = 0.5
+    retry_statuses = (429, 500, 502, 503, 504)
+    #  {resource name: filters of the list}, by default Redmine only lists the active projects and users,
+    #  the closed projects and the locked users still have time entries
+    list_filters = {
+        'project': {'status': '*'},
+        'user': {'status': ''},
+    }
+
     def __init__(self, url, key='', year=0, month=None,
-                 from_date='2020-06-16', to_date='2020-06-30', username='', password=''):
+                 from_date='2020-06-16', to_date='2020-06-30', username='', password='', workers=4,
+                 cache_file=None, fetch_plan=None):
+        """
+        :param fetch_plan: FetchPlan of the templates, only the resources it needs are prefetched,
+                           by default projects, users and issues
+        """
+        from redminelib import Redmine
+
         self.url = url or 'http://192.168.67.129:7777/redmine'
         if key == '':
             key = None
         self.key = key
         self.username = username
         self.password = password
+        self.workers = workers
+        self.fetch_plan = fetch_plan
+        self.store = EntityStore(cache_file) if cache_file else None
+        #  whether the server filters the time entries by `updated_on`, probed at the first incremental sync
+        self.updated_on_filter = None
         self.redmine = Redmine(url, key=key, username=username, password=password)
+        self.session = self.create_session()
+        #  python-redmine puts the authentication on its own session, the shared one takes it over
+        engine = self.redmine.engine
+        self.session.headers.update(engine.requests['headers'])
+        self.session.auth = engine.requests.get('auth')
+        engine.session.close()
+        engine.session = self.session
         self.current = self.redmine.user.get('current')
+        self.set_period(year=year, month=month, from_date=from_date, to_date=to_date)
+
+        if self.key is None:
+            try:
+                self.custom_session = self.create_custom_session()
+            except Exception as e:
+                self.custom_session = None
+            if self.custom_session is None:
+                click.echo('Warming: SPDM simulated user login failure, unable to use the project filtering function')
+            else:
+                click.echo('Info: SPDM simulates successful login of the user')
+        else:
+            self.custom_session = None
+            click.echo('Warming: Current using token unable to use the project filtering function')
+
+    def set_period(self, year=0, month=None, from_date=None, to_date=None):
+        """
+        the statistical period, the month of the year or from_date to to_date,
+        an adapter is reused for other periods with its session and login
+        """
         if month is None:
             self.from_date = from_date
             self.to_date = to_date
@@ -475,22 +1765,39 @@ class RedmineAdapter(object):
             self.from_date = str(first_day)
             self.to_date = str(last_day)
 
-        if self.key is None:
-            try:
-                self.custom_session = self.create_custom_session()
-            except Exception as e:
-                self.custom_session = None
-            if self.custom_session is None:
-                click.echo('Warming: SPDM simulated user login failure, unable to use the project filtering function')
-            else:
-                click.echo('Info: SPDM simulates successful login of the user')
-        else:
-            self.custom_session = None
-            click.echo('Warming: Current using token unable to use the project filtering function')
+    def create_session(self):
+        """
+        the requests session shared by python-redmine and the login, it keeps `workers` connections alive,
+        every request has a timeout and is retried on its own so a failed page is fetched again by itself
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        timeout = self.timeout
+
+        class TimeoutHTTPAdapter(HTTPAdapter):
+            def send(self, request, **kwargs):
+                if kwargs.get('timeout') is None:
+                    kwargs['timeout'] = timeout
+                return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+        retry = Retry(total=self.retries, backoff_factor=self.backoff_factor,
+                      status_forcelist=self.retry_statuses, raise_on_status=False)
+        adapter = TimeoutHTTPAdapter(pool_maxsize=max(self.workers, 10), max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        session.hooks['response'].append(profiler.on_response)
+        return session
 
     def create_custom_session(self):
+        from lxml import html
+
+        etree = html.etree
         login_url = '{0}/login'.format(self.redmine.url)
-        session = requests.session()
+        session = self.session
         result = session.get(login_url)
         auth_data = {
             'username': self.username,
@@ -530,13 +1837,38 @@ class RedmineAdapter(object):
 
         return first_day, last_day
 
-    def get_work_times(self, offset, limit=20):
+    def get_work_times(self, offset, limit=20, from_date=None, to_date=None, **filters):
         work_times = self.redmine.time_entry.filter(offset=offset,
                                                     limit=limit,
-                                                    from_date=self.from_date,
-                                                    to_date=self.to_date)
+                                                    from_date=from_date or self.from_date,
+                                                    to_date=to_date or self.to_date,
+                                                    **filters)
         return work_times
 
+    @staticmethod
+    def split_period(from_date, to_date, days):
+        """
+        :return: [(from_date, to_date)] of at most `days` days covering the period
+        """
+        first_day = datetime.datetime.strptime(from_date, '%Y-%m-%d').date()
+        last_day = datetime.datetime.strptime(to_date, '%Y-%m-%d').date()
+        periods = []
+        while first_day <= last_day:
+            period_last_day = min(first_day + datetime.timedelta(days=days - 1), last_day)
+            periods.append((str(first_day), str(period_last_day)))
+            first_day = period_last_day + datetime.timedelta(days=1)
+        return periods
+
+    def get_sub_periods(self, total_count, limit):
+        """
+        the pages of a long period are split by date, since deep offsets get slow on the server
+        :return: the sub periods to paginate, None to paginate the whole period
+        """
+        if total_count <= limit * self.max_period_pages:
+            return None
+        sub_periods = self.split_period(self.from_date, self.to_date, self.split_days)
+        return sub_periods if len(sub_periods) > 1 else None
+
     def get_project_by_identifier(self, identifier):
         """
         get project object
@@ -556,76 +1888,352 @@ class RedmineAdapter(object):
             project = self.get_project_by_identifier(name)
         return project
 
-    def _get_projects(self):
-        stacks = [0]
-        projects = Projects(self.redmine)
-        work_times = []
+    def _get_work_time_page(self, period, offset, limit, filters):
+        work_times = self.get_work_times(offset, limit=limit, from_date=period[0], to_date=period[1], **filters)
+        return list(work_times), work_times.total_count
 
-        def loop():
-            _work_times = self.get_work_times(0, limit=1)
-            _work_times_num = len(_work_times)
-            click.echo('Step one: Downloading data from SPDM,please waiting....')
-            with click.progressbar(length=_work_times.total_count) as bar:
-                while True:
-                    offset = stacks.pop()
-                    _work_times = self.get_work_times(offset)
-                    for work_time in _work_times:
-                        remote_user = work_time.user
-                        remote_project = work_time.project
-                        remote_issue = getattr(work_time, 'issue', None)
-                        project = projects.get_project(remote_project)
-                        user = project.get_user(remote_user)
-                        if remote_issue is not None:
-                            task = user.get_task(remote_issue)
-                            work_time = task.get_work_time(work_time)
-                        else:
-                            logger.warning('object{0} has no attribute issue'.format(str(work_time)))
-                        assert work_time is not None
-                    work_times.extend(_work_times)
-                    current_count = len(work_times)
-                    bar.update(len(_work_times))
-                    if current_count < _work_times.total_count:
-                        stacks.append(current_count)
-        try:
-            loop()
-        except IndexError:
-            pass
+    @staticmethod
+    def get_work_time_queries(project_ids, filters):
+        """
+        :param project_ids: ids of the projects, None for all the projects
+        :return: the filters of each time entry query, one query per project without its sub projects
+        """
+        if project_ids is None:
+            return [filters]
+        return [dict(filters, project_id=project_id, subproject_id='!*') for project_id in project_ids]
+
+    def _fetch_work_times(self, project_ids=None, **filters):
+        """
+        download the time entries of the period, the first page of each query tells its total count,
+        the remaining pages are fetched in parallel. Long periods are split into sub periods
+        paginated separately
+        :param project_ids: only download the time entries of these projects, by default all the projects
+        :param filters: additional time entry filters
+        :return: time entries ordered by id
+        """
+        period = (self.from_date, self.to_date)
+        queries = self.get_work_time_queries(project_ids, filters)
+        click.echo('Step one: Downloading data from SPDM,please waiting....')
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            first_pages = list(executor.map(
+                profiler.bind(lambda query: self._get_work_time_page(period, 0, self.page_size, query)), queries))
+            total_count = sum(query_total_count for page, query_total_count in first_pages)
+            with click.progressbar(length=total_count) as bar:
+                work_times, pages = [], []
+                for query, (page, query_total_count) in zip(queries, first_pages):
+                    limit, offsets = page_offsets(query_total_count, len(page), self.page_size)
+                    sub_periods = self.get_sub_periods(query_total_count, limit)
+                    if sub_periods is None:
+                        work_times.extend(page)
+                        pages.extend((period, offset, limit, query) for offset in offsets)
+                        continue
+                    sub_first_pages = executor.map(
+                        profiler.bind(lambda sub_period: self._get_work_time_page(sub_period, 0, limit, query)),
+                        sub_periods)
+                    for sub_period, (sub_page, sub_total_count) in zip(sub_periods, sub_first_pages):
+                        work_times.extend(sub_page)
+                        sub_limit, sub_offsets = page_offsets(sub_total_count, len(sub_page), limit)
+                        pages.extend((sub_period, offset, sub_limit, query) for offset in sub_offsets)
+                bar.update(len(work_times))
+                for page, page_total_count in executor.map(
+                        profiler.bind(lambda page: self._get_work_time_page(*page)), pages):
+                    work_times.extend(page)
+                    bar.update(len(page))
+        return self.get_unique_work_times(work_times, total_count)
+
+    @staticmethod
+    def get_unique_work_times(work_times, total_count):
+        """
+        pages may overlap when entries are added during the download
+        :return: time entries ordered by id
+        """
+        unique_work_times = {}
+        for work_time in work_times:
+            unique_work_times.setdefault(work_time.id, work_time)
+        if len(unique_work_times) != total_count:
+            logger.warning('Downloaded {0} time entries, expected {1}'.format(len(unique_work_times), total_count))
+        return [unique_work_times[uid] for uid in sorted(unique_work_times)]
+
+    def _sync_work_times(self):
+        """
+        bring the local store up to date with the time entries changed since the last sync of the period
+        :return: time entries of the period ordered by id
+        """
+        key = 'time_entry:{0}:{1}'.format(self.from_date, self.to_date)
+        synced_on = self.store.get_synced_on(key)
+        started_on = self.store.now()
+        if synced_on is None:
+            self.store.save('time_entry', self._fetch_work_times(), started_on)
+        elif self.has_updated_on_filter():
+            self.store.save('time_entry', self._fetch_work_times(updated_on='>=' + synced_on), started_on)
+            self._sync_deleted_work_times()
+        else:
+            logger.warning('The server does not filter time entries by updated_on, downloading all of them')
+            work_times = self._fetch_work_times()
+            self.store.save('time_entry', work_times, started_on)
+            local_ids = self.store.get_time_entry_ids(self.from_date, self.to_date)
+            self.store.delete('time_entry', local_ids - {work_time.id for work_time in work_times})
+        self.store.set_synced_on(key, started_on)
+        return [self.redmine.time_entry.to_resource(data)
+                for data in self.store.load_time_entries(self.from_date, self.to_date)]
+
+    def has_updated_on_filter(self):
+        """
+        servers that don't know the filter ignore it, no time entry can be updated after the far future
+        """
+        from redminelib.exceptions import BaseRedmineError
+
+        if self.updated_on_filter is None:
+            try:
+                probe = self.get_work_times(0, limit=1, updated_on='>=9999-12-31T00:00:00Z')
+                list(probe)
+                self.updated_on_filter = probe.total_count == 0
+            except BaseRedmineError as e:
+                logger.warning('Unable to filter time entries by updated_on: {0}'.format(repr(e)))
+                self.updated_on_filter = False
+        return self.updated_on_filter
+
+    def _sync_deleted_work_times(self):
+        """
+        all the created and updated entries are in the store, so the store holds a superset of the
+        server's entries and the ids only have to be compared when the counts differ
+        """
+        first_page = self.get_work_times(0, limit=1)
+        list(first_page)
+        local_ids = self.store.get_time_entry_ids(self.from_date, self.to_date)
+        if len(local_ids) != first_page.total_count:
+            remote_ids = {work_time.id for work_time in self._fetch_work_times()}
+            self.store.delete('time_entry', local_ids - remote_ids)
+
+    @profiler.profiled('_download_work_times')
+    def _download_work_times(self, project_ids=None):
+        """
+        :param project_ids: only download the time entries of these projects, by default all the projects.
+                            the local store keeps all the projects of a period, it ignores them
+        """
+        if self.store is None:
+            return self._fetch_work_times(project_ids)
+        return self._sync_work_times()
+
+    @profiler.profiled('build_projects')
+    def build_projects(self, work_times):
+        projects = Projects(self.redmine)
+        #  the templates read attributes the work times don't copy, keep the downloaded resources
+        keep_work_times = self.fetch_plan is not None and 'time_entry' in self.fetch_plan.resources
+        for work_time in work_times:
+            #  the raw data avoids decoding a python-redmine resource per attribute
+            values = work_time.raw()
+            remote_user = values['user']
+            remote_project = values['project']
+            remote_issue = values.get('issue')
+            project = projects.get_project(remote_project)
+            user = project.get_user(remote_user)
+            if remote_issue is not None:
+                task = user.get_task(remote_issue)
+                local_work_time = task.get_work_time(values)
+                if keep_work_times:
+                    local_work_time.set_cached_remote_resource(work_time)
+            else:
+                logger.warning('object{0} has no attribute issue'.format(str(work_time)))
         return projects
 
+    @profiler.profiled('_get_projects')
+    def _get_projects(self, project_ids=None):
+        return self.build_projects(self._download_work_times(project_ids))
+
     def _get_sub_projects(self, project_id):
         sub_project_url = '{0}/projects/{1}/children'.format(self.redmine.url, project_id)
-        try:
-            response = self.custom_session.get(sub_project_url)
-        except Exception as e:
-            response = None
-        if response and response.status_code == 200:
-            items = json.loads(response.content)
-            projects = items.get('children')
-            return [CustomRemoteProject(project.get('id'), project.get('name')) for project in projects]
-        return []
+        #  connection and server errors are raised once the retries of the session are spent
+        response = self.custom_session.get(sub_project_url)
+        if response.status_code in (403, 404):
+            #  a project whose children can't be seen has none
+            logger.warning('Unable to get the sub projects of project {0}: {1}'.format(project_id,
+                                                                                       response.status_code))
+            return []
+        response.raise_for_status()
+        items = json.loads(response.content)
+        return [CustomRemoteProject(project.get('id'), project.get('name')) for project in items.get('children')]
 
-    def get_sub_projects(self, project):
+    @staticmethod
+    def walk_sub_projects(project, children):
+        """
+        the projects of a tree in the order `get_sub_projects` yields them
+        :param project: the root project
+        :param children: {project id: [child project]}
+        """
         stack = [project]
-        projects = []
-        while True:
-            try:
-                current_project = stack.pop()
-                if current_project not in projects:
-                    yield current_project
-                    projects.append(current_project)
-            except IndexError:
-                return
-            stack.extend(self._get_sub_projects(current_project.id))
+        project_ids = set()
+        while stack:
+            current_project = stack.pop()
+            if current_project.id not in project_ids:
+                project_ids.add(current_project.id)
+                yield current_project
+                stack.extend(children.get(current_project.id, []))
+
+    @staticmethod
+    def add_project_level(children, results):
+        """
+        :param children: {project id: [child project]} of the levels seen so far
+        :param results: (project id, [child project]) of the current level
+        :return: the projects of the next level
+        """
+        level = []
+        for project_id, sub_projects in results:
+            children[project_id] = sub_projects
+            for sub_project in sub_projects:
+                if sub_project.id not in children:
+                    children[sub_project.id] = []
+                    level.append(sub_project)
+        return level
+
+    def _fetch_project_tree(self, project):
+        """
+        request the children of a whole level of the tree in parallel
+        :return: {project id: [child project]}
+        """
+        children = {project.id: []}
+        level = [project]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while level:
+                results = executor.map(profiler.bind(lambda current_project: (
+                    current_project.id, self._get_sub_projects(current_project.id))), level)
+                level = self.add_project_level(children, results)
+        return children
+
+    def get_project_tree(self, project):
+        """
+        :return: {project id: [child project]}, kept in the local store for `project_tree_max_age`
+        """
+        if self.store is None:
+            return self._fetch_project_tree(project)
+        synced_after = (datetime.datetime.now(datetime.timezone.utc) - self.project_tree_max_age).strftime(
+            '%Y-%m-%dT%H:%M:%SZ')
+        children = self.store.load_project_tree(project.id, synced_after)
+        if children is None:
+            started_on = self.store.now()
+            children = self._fetch_project_tree(project)
+            self.store.save_project_tree(project.id, children, started_on)
+        return children
+
+    @profiler.profiled('get_sub_projects')
+    def get_sub_projects(self, project):
+        return self.walk_sub_projects(project, self.get_project_tree(project))
+
+    def close(self):
+        #  the custom session is the shared session once logged in
+        self.session.close()
+        if self.store is not None:
+            self.store.close()
 
     def get_projects(self, redmine_project=None):
-        projects = self._get_projects()
         if redmine_project is not None and self.custom_session is not None:
-            projects = self.checkout_projects(projects, redmine_project)
+            #  the tree is resolved first so that only the time entries of its projects are downloaded
+            sub_projects = list(self.get_sub_projects(self.get_entry_project(redmine_project)))
+            projects = self._get_projects([project.id for project in sub_projects])
+            projects = self.select_projects(projects, sub_projects)
         else:
             click.echo('Warming: Ignore project')
+            projects = self._get_projects()
+        self.prefetch(projects)
         return projects
 
-    def checkout_projects(self, src_projects, redmine_project):
+    def _get_issues(self, uids, filters):
+        issues = self.redmine.issue.filter(issue_id=','.join(str(uid) for uid in uids),
+                                           status_id='*',
+                                           limit=len(uids),
+                                           **filters)
+        return list(issues)
+
+    def _fetch_issues(self, uids, **filters):
+        uids = list(uids)
+        chunks = [uids[i:i + self.page_size] for i in range(0, len(uids), self.page_size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pages = executor.map(profiler.bind(lambda chunk: self._get_issues(chunk, filters)), chunks)
+            return [issue for issues in pages for issue in issues]
+
+    def get_issues(self, uids):
+        """
+        get issues with batched `issue_id` filters, the batches are fetched in parallel.
+        with a local store only the unknown issues and the ones updated since they were stored are fetched,
+        an issue deleted on the server stays in the store but no synced time entry refers to it any more
+        :param uids: issue ids
+        :return: issue objects ordered by id
+        """
+        if self.store is None:
+            return self._fetch_issues(uids)
+        started_on = self.store.now()
+        cached_issues = self.store.load('issue', uids)
+        issues = self._fetch_issues([uid for uid in uids if uid not in cached_issues])
+        if cached_issues:
+            synced_on = min(synced_on for synced_on, data in cached_issues.values())
+            issues.extend(self._fetch_issues(cached_issues.keys(), updated_on='>=' + synced_on))
+        self.store.save('issue', issues, started_on)
+        raw_issues = dict((uid, data) for uid, (synced_on, data) in cached_issues.items())
+        raw_issues.update((issue.id, issue.raw()) for issue in issues)
+        return [self.redmine.issue.to_resource(raw_issues[uid]) for uid in sorted(raw_issues)]
+
+    def _fetch_all(self, resource_name):
+        return list(getattr(self.redmine, resource_name).all(**self.list_filters[resource_name]))
+
+    def _get_all(self, resource_name):
+        """
+        list all the projects or users, they are always listed again, the list is kept in the local store
+        only as a fallback when the account is not allowed to list them
+        """
+        from redminelib.exceptions import BaseRedmineError
+
+        manager = getattr(self.redmine, resource_name)
+        if self.store is None:
+            return self._fetch_all(resource_name)
+        started_on = self.store.now()
+        try:
+            remote_resources = self._fetch_all(resource_name)
+        except BaseRedmineError:
+            remote_resources = [manager.to_resource(data)
+                                for synced_on, data in self.store.load(resource_name).values()]
+            if not remote_resources:
+                raise
+        else:
+            self.store.save(resource_name, remote_resources, started_on)
+        return remote_resources
+
+    @profiler.profiled('prefetch')
+    def prefetch(self, *all_projects):
+        """
+        resolve the remote resources of all projects, users and tasks with a few list requests,
+        so that rendering does not fall back to one `get` request per resource
+        :param all_projects: Projects instances
+        """
+        from redminelib.exceptions import BaseRedmineError
+
+        local_resources = {'project': {}, 'user': {}, 'issue': {}}
+        for project in (project for projects in all_projects for project in projects.projects):
+            local_resources['project'].setdefault(project.uid, []).append(project)
+            for user in project.users:
+                local_resources['user'].setdefault(user.uid, []).append(user)
+                for task in user.tasks:
+                    local_resources['issue'].setdefault(task.uid, []).append(task)
+        fetchers = {
+            'project': lambda uids: self._get_all('project'),
+            'user': lambda uids: self._get_all('user'),
+            'issue': self.get_issues,
+        }
+        for resource_name, resources in local_resources.items():
+            if not resources:
+                continue
+            if self.fetch_plan is not None and resource_name not in self.fetch_plan.resources:
+                continue
+            try:
+                remote_resources = list(fetchers[resource_name](list(resources.keys())))
+            except BaseRedmineError as e:
+                #  e.g. listing users requires administrator, those are fetched lazily
+                logger.warning('Unable to prefetch {0}: {1}'.format(resource_name, repr(e)))
+                continue
+            for remote_resource in remote_resources:
+                for resource in resources.get(remote_resource.id, []):
+                    resource.set_cached_remote_resource(remote_resource)
+
+    def get_entry_project(self, redmine_project):
         try:
             entry_project = self.get_project_by_name(redmine_project)
         except Exception as e:
@@ -633,37 +2241,704 @@ class RedmineAdapter(object):
         if redmine_project is not None and entry_project is None:
             raise ValueError('The item named `{0}` could not be found'.format(redmine_project))
         click.echo('Locate the {0} project'.format(entry_project.name))
-        sub_projects = self.get_sub_projects(entry_project)
+        return entry_project
+
+    @staticmethod
+    @profiler.profiled('checkout_projects')
+    def select_projects(src_projects, sub_projects):
+        """
+        keep the projects of the sub project tree, in the order of the tree,
+        the time entries of the other projects no longer count for the totals
+        """
         click.echo('Step two: Checkout projects,please waiting....')
         projects = []
-        tests = []
         with click.progressbar(sub_projects) as bar:
             for dst_project in bar:
-                tests.append(dst_project)
                 project = src_projects.get_project_by_project_id(dst_project.id)
                 if project is not None:
                     projects.append(project)
             src_projects.clear_resource()
             src_projects.extend_resource(projects)
+            src_projects.time_entries.select('project', [project.uid for project in projects])
         return src_projects
 
+    def get_batch_projects(self, periods, redmine_projects):
+        """
+        download the time entries of all the periods at once and split them into one Projects per
+        period and project, each the same as `get_projects` of a single period and project
+        :param periods: [(from_date, to_date)]
+        :param redmine_projects: project identifiers, None for all the projects
+        :return: [((from_date, to_date), redmine_project, Projects)]
+        """
+        self.from_date = min(from_date for from_date, to_date in periods)
+        self.to_date = max(to_date for from_date, to_date in periods)
+        sub_projects = {}
+        for redmine_project in redmine_projects:
+            if redmine_project is not None and self.custom_session is not None:
+                sub_projects[redmine_project] = list(self.get_sub_projects(self.get_entry_project(redmine_project)))
+            else:
+                click.echo('Warming: Ignore project')
+                sub_projects[redmine_project] = None
+        project_ids = None
+        if all(projects is not None for projects in sub_projects.values()):
+            #  every report is a project tree, only the projects of the trees are downloaded
+            project_ids = list(OrderedDict((project.id, None) for projects in sub_projects.values()
+                                           for project in projects))
+        work_times = self._download_work_times(project_ids)
+        batch = []
+        for from_date, to_date in periods:
+            period_work_times = [work_time for work_time in work_times
+                                 if from_date <= work_time.raw()['spent_on'] <= to_date]
+            for redmine_project in redmine_projects:
+                projects = self.build_projects(period_work_times)
+                if sub_projects[redmine_project] is not None:
+                    projects = self.select_projects(projects, sub_projects[redmine_project])
+                batch.append(((from_date, to_date), redmine_project, projects))
+        self.prefetch(*[projects for period, redmine_project, projects in batch])
+        return batch
+
     def get_current_user_fullname(self):
         return '{0}{1}'.format(self.current.lastname, self.current.firstname)
 
 
+class AsyncRedmineClient(object):
+    """
+    Redmine REST client on one pooled keep-alive aiohttp connector,
+    at most `concurrency` requests are in flight at the same time
+    """
+    #  {status code: redminelib exception name}
+    errors = {
+        401: 'AuthError',
+        403: 'ForbiddenError',
+        404: 'ResourceNotFoundError',
+        500: 'ServerError',
+    }
+    #  the same timeouts and retries as the requests session of RedmineAdapter
+    timeout = RedmineAdapter.timeout
+    retries = RedmineAdapter.retries
+    backoff_factor = RedmineAdapter.backoff_factor
+    retry_statuses = RedmineAdapter.retry_statuses
+
+    def __init__(self, url, key=None, username='', password='', cookies=None, concurrency=4):
+        self.url = url
+        self.headers = {'X-Redmine-API-Key': key} if key is not None else {}
+        self.auth = (username, password) if key is None and username else None
+        self.cookies = cookies or {}
+        self.concurrency = concurrency
+        self._session = None
+        self._semaphore = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            import asyncio
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+            auth = aiohttp.BasicAuth(*self.auth) if self.auth is not None else None
+            timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                                  auth=auth, cookies=self.cookies, timeout=timeout)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def get_json(self, path, **params):
+        """
+        a request is retried on its own after a connection error, a timeout or one of `retry_statuses`
+        """
+        import asyncio
+        import aiohttp
+
+        session = self.session
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1) if attempt > 1 else 0)
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    async with session.get(self.url + path, params=params) as response:
+                        status = response.status
+                        content = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+                continue
+            profiler.count_request(len(content), time.perf_counter() - started)
+            if status == 200:
+                return json.loads(content)
+            if status not in self.retry_statuses or attempt == self.retries:
+                break
+
+        from redminelib import exceptions
+
+        error = self.errors.get(status)
+        if error is None:
+            raise exceptions.UnknownError(status)
+        raise getattr(exceptions, error)()
+
+    async def get_pages(self, path, container, page_size, on_page=None, first_page=None, **params):
+        """
+        get all the pages of a list, the first page tells the total count,
+        the remaining pages are requested concurrently
+        :param on_page: called with the items and the total count of every page
+        :param first_page: the first page when it has already been requested
+        :return: items, total_count
+        """
+        import asyncio
+
+        if first_page is None:
+            first_page = await self.get_json(path, offset=0, limit=page_size, **params)
+        items = first_page[container]
+        total_count = first_page.get('total_count', len(items))
+        if on_page is not None:
+            on_page(items, total_count)
+        limit, offsets = page_offsets(total_count, len(items), page_size)
+
+        async def get_page(offset):
+            page = (await self.get_json(path, offset=offset, limit=limit, **params))[container]
+            if on_page is not None:
+                on_page(page, total_count)
+            return page
+
+        for page in await asyncio.gather(*[get_page(offset) for offset in offsets]):
+            items.extend(page)
+        return items, total_count
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncRedmineAdapter(RedmineAdapter):
+    """
+    RedmineAdapter downloading time entries, sub projects and prefetched resources with asyncio.
+    It builds the same Projects object graph, `workers` caps the concurrent requests.
+    """
+    list_paths = {
+        'project': ('/projects.json', 'projects'),
+        'user': ('/users.json', 'users'),
+    }
+
+    def __init__(self, *args, **kwargs):
+        import asyncio
+
+        super(AsyncRedmineAdapter, self).__init__(*args, **kwargs)
+        self.loop = asyncio.new_event_loop()
+        cookies = self.custom_session.cookies.get_dict() if self.custom_session is not None else None
+        self.client = AsyncRedmineClient(self.redmine.url, key=self.key, username=self.username,
+                                         password=self.password, cookies=cookies, concurrency=self.workers)
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def close(self):
+        self.run(self.client.close())
+        self.loop.close()
+        super(AsyncRedmineAdapter, self).close()
+
+    def get_period_filters(self, **filters):
+        #  the names python-redmine gives the `from_date` and `to_date` filters of time entries
+        return dict(filters, **{'from': self.from_date, 'to': self.to_date})
+
+    def _fetch_work_times(self, project_ids=None, **filters):
+        click.echo('Step one: Downloading data from SPDM,please waiting....')
+        progress = {}
+
+        def on_page(items, total_count):
+            progress['bar'].update(len(items))
+
+        async def get_query_work_times(filters_of_period, first_page):
+            import asyncio
+
+            limit = page_offsets(first_page['total_count'], len(first_page['time_entries']), self.page_size)[0]
+            sub_periods = self.get_sub_periods(first_page['total_count'], limit)
+            if sub_periods is None:
+                items, total_count = await self.client.get_pages('/time_entries.json', 'time_entries',
+                                                                 self.page_size, on_page=on_page,
+                                                                 first_page=first_page, **filters_of_period)
+                return items
+            results = await asyncio.gather(*[
+                self.client.get_pages('/time_entries.json', 'time_entries', self.page_size, on_page=on_page,
+                                      **dict(filters_of_period, **{'from': from_date, 'to': to_date}))
+                for from_date, to_date in sub_periods])
+            return [item for items, sub_total_count in results for item in items]
+
+        async def get_work_times():
+            import asyncio
+
+            queries = [self.get_period_filters(**query) for query in self.get_work_time_queries(project_ids, filters)]
+            first_pages = await asyncio.gather(*[
+                self.client.get_json('/time_entries.json', offset=0, limit=self.page_size, **query)
+                for query in queries])
+            total_count = sum(first_page['total_count'] for first_page in first_pages)
+            progress['bar'] = click.progressbar(length=total_count)
+            results = await asyncio.gather(*[get_query_work_times(query, first_page)
+                                             for query, first_page in zip(queries, first_pages)])
+            return [item for items in results for item in items], total_count
+
+        try:
+            items, total_count = self.run(get_work_times())
+        finally:
+            if 'bar' in progress:
+                progress['bar'].render_finish()
+        manager = self.redmine.time_entry
+        return self.get_unique_work_times([manager.to_resource(item) for item in items], total_count)
+
+    async def _get_children(self, project_id):
+        from redminelib import exceptions
+
+        try:
+            items = await self.client.get_json('/projects/{0}/children'.format(project_id))
+        except (exceptions.ForbiddenError, exceptions.ResourceNotFoundError) as e:
+            #  like the sync adapter, a project whose children can't be seen has none,
+            #  connection and server errors are raised once the retries are spent
+            logger.warning('Unable to get the sub projects of project {0}: {1}'.format(project_id, repr(e)))
+            return project_id, []
+        return project_id, [CustomRemoteProject(project.get('id'), project.get('name'))
+                            for project in items.get('children')]
+
+    async def _get_project_tree(self, project):
+        import asyncio
+
+        children = {project.id: []}
+        level = [project]
+        while level:
+            results = await asyncio.gather(*[self._get_children(current_project.id) for current_project in level])
+            level = self.add_project_level(children, results)
+        return children
+
+    def _fetch_project_tree(self, project):
+        return self.run(self._get_project_tree(project))
+
+    def _fetch_issues(self, uids, **filters):
+        uids = list(uids)
+        chunks = [uids[i:i + self.page_size] for i in range(0, len(uids), self.page_size)]
+
+        async def get_issues():
+            import asyncio
+
+            pages = await asyncio.gather(*[
+                self.client.get_json('/issues.json', issue_id=','.join(str(uid) for uid in chunk),
+                                     status_id='*', limit=len(chunk), **filters)
+                for chunk in chunks])
+            return [issue for page in pages for issue in page['issues']]
+
+        manager = self.redmine.issue
+        return [manager.to_resource(item) for item in self.run(get_issues())]
+
+    def _fetch_all(self, resource_name):
+        path, container = self.list_paths[resource_name]
+        items, total_count = self.run(self.client.get_pages(path, container, self.page_size,
+                                                            **self.list_filters[resource_name]))
+        manager = getattr(self.redmine, resource_name)
+        return [manager.to_resource(item) for item in items]
+
+
+redmine_adapters = OrderedDict([
+    ('sync', RedmineAdapter),
+    ('async', AsyncRedmineAdapter),
+])
+
+
+class RowPipeline(object):
+    """
+    Download, aggregate and render overlapped. The time entries are requested sorted by project and user
+    (the projects of a tree are queried one by one in the order of the tree), a (project, user) group is built
+    and rendered as soon as the entries of the next group arrive, and the values of its rows go to the Excel
+    writer through a bounded queue. Consecutive groups are rendered in chunks whose issues are fetched together,
+    only the current chunk and the fetched issues are kept in memory.
+
+    The rows follow the collation of the server database, names that only differ in case or accents are sorted
+    together (case-insensitive on most databases) and their groups are yielded in the order of the first entry.
+    """
+    #  Redmine sorts the project and the user by name, the entries of names the collation holds equal may be
+    #  interleaved, see `collation_key`
+    sort = 'project,user,id'
+    #  rendered rows waiting for the writer
+    queue_size = 1000
+    #  time entries of a chunk at most, a chunk also ends when its new issues fill a page of the `issue_id` filter
+    chunk_size = 1000
+    done = object()
+
+    def __init__(self, redmine: RedmineAdapter, row_plan: RowPlan, fetch_plan: FetchPlan, row_mode='user'):
+        self.redmine = redmine
+        self.row_plan = row_plan
+        self.fetch_plan = fetch_plan
+        self.row_mode = row_mode
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._cancelled = threading.Event()
+        #  {id: issue} of the issues fetched for the previous chunks
+        self._issues = {}
+
+    @staticmethod
+    def can_stream(fetch_plan: FetchPlan):
+        """
+        a group only holds the users of its project, templates reading the users of a project need all of them
+        """
+        attributes = fetch_plan.attributes['project']
+        return 'users' not in attributes and FetchPlan.ANY not in attributes
+
+    def iter_work_times(self, project_ids=None):
+        """
+        the time entries of the period in the order of the server, `workers` pages are downloaded ahead
+        :param project_ids: ids of the projects, queried one after another, None for all the projects
+        """
+        redmine = self.redmine
+        period = (redmine.from_date, redmine.to_date)
+        with ThreadPoolExecutor(max_workers=redmine.workers) as executor:
+            for query in redmine.get_work_time_queries(project_ids, {'sort': self.sort}):
+                work_times, total_count = redmine._get_work_time_page(period, 0, redmine.page_size, query)
+                limit, offsets = page_offsets(total_count, len(work_times), redmine.page_size)
+                offsets = iter(offsets)
+
+                def submit(offset):
+                    return executor.submit(profiler.bind(redmine._get_work_time_page), period, offset, limit, query)
+
+                pending = deque(submit(offset) for offset in itertools.islice(offsets, redmine.workers))
+                for work_time in work_times:
+                    yield work_time
+                while pending:
+                    if self._cancelled.is_set():
+                        return
+                    page, page_total_count = pending.popleft().result()
+                    pending.extend(submit(offset) for offset in itertools.islice(offsets, 1))
+                    for work_time in page:
+                        yield work_time
+
+    @staticmethod
+    def collation_key(name):
+        """
+        :return: the name as a case and accent insensitive collation of the server compares it
+        """
+        name = unicodedata.normalize('NFKD', name or '')
+        return ''.join(char for char in name if not unicodedata.combining(char)).casefold().rstrip()
+
+    def iter_groups(self, project_ids=None):
+        """
+        :param project_ids: ids of the projects, None for all the projects
+        :return: the time entries of each (project id, user id) group. the entries are gathered by the names
+                 the server sorts by and grouped by ids when the names end, so the same names of different
+                 projects or users and names that only differ in case are not split into several groups
+        """
+        seen = set()
+        run_key = None
+        #  {(project id, user id): time entries} of the entries sorted under the same names
+        run = OrderedDict()
+        for work_time in self.iter_work_times(project_ids):
+            values = work_time.raw()
+            #  the overlaps of the pages, see `RedmineAdapter.get_unique_work_times`
+            if values['id'] in seen:
+                continue
+            seen.add(values['id'])
+            key = (self.collation_key(values['project']['name']), self.collation_key(values['user']['name']))
+            if key != run_key:
+                for group in run.values():
+                    yield group
+                run = OrderedDict()
+                run_key = key
+            run.setdefault((values['project']['id'], values['user']['id']), []).append(work_time)
+        for group in run.values():
+            yield group
+
+    def iter_chunks(self, groups):
+        """
+        :param groups: the time entries of each (project, user) group
+        :return: lists of consecutive groups
+        """
+        if 'issue' not in self.fetch_plan.resources:
+            for group in groups:
+                yield [group]
+            return
+        chunk, issue_ids, size = [], set(), 0
+        for group in groups:
+            chunk.append(group)
+            size += len(group)
+            issue_ids.update(values['issue']['id'] for values in (work_time.raw() for work_time in group)
+                             if 'issue' in values and values['issue']['id'] not in self._issues)
+            if len(issue_ids) >= self.redmine.page_size or size >= self.chunk_size:
+                yield chunk
+                chunk, issue_ids, size = [], set(), 0
+        if chunk:
+            yield chunk
+
+    def get_project_ids(self, redmine_project):
+        """
+        :return: the ids of the project tree in the order of the tree, None for all the projects
+        """
+        if redmine_project is not None and self.redmine.custom_session is not None:
+            entry_project = self.redmine.get_entry_project(redmine_project)
+            return [project.id for project in self.redmine.get_sub_projects(entry_project)]
+        click.echo('Warming: Ignore project')
+        return None
+
+    def get_all_resources(self):
+        """
+        :return: {resource name: {uid: remote resource}} of the projects and users the templates need,
+                 listed once for all the groups
+        """
+        from redminelib.exceptions import BaseRedmineError
+
+        all_resources = {}
+        for resource_name in ('project', 'user'):
+            if resource_name not in self.fetch_plan.resources:
+                continue
+            try:
+                all_resources[resource_name] = dict((remote_resource.id, remote_resource) for remote_resource
+                                                    in self.redmine._get_all(resource_name))
+            except BaseRedmineError as e:
+                logger.warning('Unable to prefetch {0}: {1}'.format(resource_name, repr(e)))
+        return all_resources
+
+    def prefetch(self, chunk: [Projects], all_resources):
+        """
+        the same as `RedmineAdapter.prefetch` for the projects of the groups of a chunk,
+        the issues not fetched for a previous chunk are requested together
+        """
+        from redminelib.exceptions import BaseRedmineError
+
+        tasks = {}
+        for projects in chunk:
+            for project in projects.projects:
+                if project.uid in all_resources.get('project', {}):
+                    project.set_cached_remote_resource(all_resources['project'][project.uid])
+                for user in project.users:
+                    if user.uid in all_resources.get('user', {}):
+                        user.set_cached_remote_resource(all_resources['user'][user.uid])
+                    for task in user.tasks:
+                        tasks.setdefault(task.uid, []).append(task)
+        if 'issue' not in self.fetch_plan.resources:
+            return
+        try:
+            self._issues.update((issue.id, issue) for issue in
+                                self.redmine.get_issues([uid for uid in tasks if uid not in self._issues]))
+        except BaseRedmineError as e:
+            logger.warning('Unable to prefetch issue: {0}'.format(repr(e)))
+        for uid, uid_tasks in tasks.items():
+            if uid in self._issues:
+                for task in uid_tasks:
+                    task.set_cached_remote_resource(self._issues[uid])
+
+    def put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce(self, redmine_project):
+        try:
+            project_ids = self.get_project_ids(redmine_project)
+            all_resources = self.get_all_resources()
+            variables = row_modes[self.row_mode]
+            click.echo('Step one: Downloading data from SPDM,please waiting....')
+            for groups in self.iter_chunks(self.iter_groups(project_ids)):
+                chunk = [self.redmine.build_projects(group) for group in groups]
+                self.prefetch(chunk, all_resources)
+                for projects in chunk:
+                    for row in projects.get_rows(self.row_mode):
+                        self.put(self.row_plan.render(**dict(zip(variables, row))))
+                if self._cancelled.is_set():
+                    return
+            self.put(self.done)
+        except Exception as e:
+            self.put(e)
+
+    def rows(self, redmine_project=None):
+        """
+        the values of the rows, rendered by a thread while they are written
+        :param redmine_project: project identifier, None for all the projects
+        """
+        producer = threading.Thread(target=profiler.bind(self.produce), args=(redmine_project,), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self.done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self._cancelled.set()
+            producer.join()
+
+
+@profiler.profiled('parse')
+def load_row_plan(source_name):
+    return template_cache.load_row_plan(source_name)
+
+
+#  {RowPlan sources: RowPlan} compiled in a worker process
+worker_row_plans = {}
+
+
+def render_snapshot_rows(sources, variables, rows):
+    """
+    render rows in a worker process
+    :param sources: RowPlan.sources of the template
+    :param variables: the variables of the row context, `row_modes[row_mode]`
+    :param rows: [(project Snapshot, user Snapshot, ...)]
+    :return: the values of the rows
+    """
+    row_plan = worker_row_plans.get(sources)
+    if row_plan is None:
+        row_plan = worker_row_plans[sources] = RowPlan.from_sources(sources)
+    return [row_plan.render(**dict(zip(variables, row))) for row in rows]
+
+
+def render_rows_parallel(row_plan, fetch_plan, rows, jobs, chunk_size=500, row_mode='user'):
+    """
+    render the rows of a row mode in `jobs` processes, the rows are copied into Snapshots
+    and sent in chunks, the values come back in the order of the rows
+    """
+    snapshots = {}
+    variables = row_modes[row_mode]
+    kinds = [FetchPlan.variables[variable] for variable in variables]
+    rows = [tuple(Snapshot.create(resource, kind, fetch_plan, snapshots) for resource, kind in zip(row, kinds))
+            for row in rows]
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for values in executor.map(functools.partial(render_snapshot_rows, row_plan.sources, variables), chunks):
+            for row_values in values:
+                yield row_values
+
+
+def write_work_table(output_adapter, target_name, rendered_rows, enable_merge):
+    """
+    write the rendered rows of a report, runs in the worker processes of a batch
+    :param output_adapter: ExcelAdapter class
+    """
+    adapter = output_adapter("template.xlsx", target_name)
+    work_table = WorkTable(adapter, None, enable_merge=enable_merge, row_plan=load_row_plan("template.xlsx"))
+    work_table.process(rendered_rows=rendered_rows, open_excel=False)
+    return adapter.target_name
+
+
+def process_batch(periods, redmine_projects, jobs=1, **kwargs):
+    """
+    generate one Excel per period and project with a single download,
+    the workbooks are written by `jobs` processes
+    """
+    enable_merge_cells = kwargs.pop('enable_merge_cells', True)
+    output_adapter = get_output_adapter(kwargs.pop('engine', 'memory'), kwargs.pop('output_format', 'xlsx'))
+    redmine_adapter = redmine_adapters[kwargs.pop('client', 'sync')]
+    row_mode = kwargs.pop('row_mode', 'user')
+    for key in ('month', 'year', 'from_date', 'to_date'):
+        kwargs.pop(key, None)
+
+    row_plan = load_row_plan("template.xlsx")
+    redmine = redmine_adapter(fetch_plan=FetchPlan.from_row_plan(row_plan, row_mode), **kwargs)
+    try:
+        batch = redmine.get_batch_projects(periods, redmine_projects)
+        created_on = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        reports = []
+        for (from_date, to_date), redmine_project, projects in batch:
+            target_name = "{0}--{1}{2} created on {3}.xlsx".format(
+                from_date, to_date, '' if redmine_project is None else ' ' + redmine_project, created_on)
+            with profiler.phase('render'):
+                rendered_rows = [row_plan.render(**dict(zip(row_modes[row_mode], row)))
+                                 for row in WorkTable.pre_process(projects, row_mode)]
+            reports.append((output_adapter, target_name, rendered_rows, enable_merge_cells))
+    finally:
+        redmine.close()
+
+    errors = []
+    executor_class = ProcessPoolExecutor if jobs > 1 else ThreadPoolExecutor
+    with executor_class(max_workers=jobs) as executor:
+        futures = [(report[1], executor.submit(write_work_table, *report)) for report in reports]
+        for target_name, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning('Unable to generate `{0}`: {1}'.format(target_name, repr(e)))
+                errors.append(target_name)
+    if errors:
+        raise Exception('Unsuccessfully generated: {0}'.format(', '.join(errors)))
+
+
 def process(*args, **kwargs):
+    periods = kwargs.pop('periods', None) or []
+    redmine_projects = kwargs.pop('project', None)
+    if not isinstance(redmine_projects, (list, tuple)):
+        redmine_projects = [redmine_projects]
+    redmine_projects = list(redmine_projects) or [None]
+    jobs = kwargs.pop('jobs', 1)
+    open_excel = kwargs.pop('open_excel', True)
+    pipeline = kwargs.pop('pipeline', False)
+    if periods or len(redmine_projects) > 1:
+        if not periods and kwargs.get('month') is None:
+            periods = [(kwargs.pop('from_date'), kwargs.pop('to_date'))]
+        elif not periods:
+            first_day, last_day = RedmineAdapter.get_month_first_day_and_last_day(year=kwargs.get('year'),
+                                                                                  month=kwargs.get('month'))
+            periods = [(str(first_day), str(last_day))]
+        return process_batch(periods, redmine_projects, jobs=jobs, **kwargs)
+
     enable_merge_cells = kwargs.pop('enable_merge_cells', True)
-    redmine_project = kwargs.pop('project', None)
+    excel_adapter = get_output_adapter(kwargs.pop('engine', 'memory'), kwargs.pop('output_format', 'xlsx'))
+    redmine_adapter = redmine_adapters[kwargs.pop('client', 'sync')]
+    row_mode = kwargs.pop('row_mode', 'user')
 
-    redmine = RedmineAdapter(*args, **kwargs)
+    row_plan = load_row_plan("template.xlsx")
+    fetch_plan = FetchPlan.from_row_plan(row_plan, row_mode)
+    redmine = redmine_adapter(*args, fetch_plan=fetch_plan, **kwargs)
+    try:
+        generate_report(redmine, row_plan, fetch_plan, excel_adapter, redmine_project=redmine_projects[0],
+                        enable_merge_cells=enable_merge_cells, row_mode=row_mode, jobs=jobs, pipeline=pipeline,
+                        open_excel=open_excel)
+    finally:
+        redmine.close()
+
+
+def generate_report(redmine, row_plan, fetch_plan, excel_adapter, redmine_project=None, enable_merge_cells=True,
+                    row_mode='user', jobs=1, pipeline=False, open_excel=True, target_name=None):
+    """
+    generate the Excel of the period of `redmine`
+    :param redmine: RedmineAdapter created with `fetch_plan`, it is left open
+    :param excel_adapter: ExcelAdapter class
+    :param target_name: name of the Excel, by default the period and the time,
+                        the extension is the one of the adapter
+    :return: the name of the Excel
+    """
+    if pipeline and (jobs > 1 or redmine.store is not None or not RowPipeline.can_stream(fetch_plan)):
+        click.echo('Warming: --pipeline is not used with --jobs, --cache-file or templates reading project.users')
+        pipeline = False
+    if target_name is None:
+        target_name = "{0}--{1} created on {2}.xlsx".format(redmine.from_date, redmine.to_date,
+                                                            datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+    adapter = excel_adapter("template.xlsx", target_name)
+    if pipeline:
+        work_table = WorkTable(adapter, None, enable_merge=enable_merge_cells, row_plan=row_plan)
+        rendered_rows = RowPipeline(redmine, row_plan, fetch_plan, row_mode).rows(redmine_project)
+        work_table.process(rendered_rows=rendered_rows, open_excel=open_excel)
+        return adapter.target_name
     projects = redmine.get_projects(redmine_project=redmine_project)
-
-    adapter = ExcelAdapter("template.xlsx", "{0}--{1} created on {2}.xlsx".
-                           format(redmine.from_date,
-                                  redmine.to_date,
-                                  datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')))
-    work_table = WorkTable(adapter, projects, enable_merge=enable_merge_cells)
-    work_table.process()
+    work_table = WorkTable(adapter, projects, enable_merge=enable_merge_cells, row_plan=row_plan,
+                           row_mode=row_mode)
+    rendered_rows = None
+    if jobs > 1:
+        #  the rows are rendered by the processes while this one writes them
+        rendered_rows = render_rows_parallel(row_plan, fetch_plan, WorkTable.pre_process(projects, row_mode),
+                                             jobs, row_mode=row_mode)
+    work_table.process(rendered_rows=rendered_rows, open_excel=open_excel)
+    return adapter.target_name
+
+
+def parse_periods(ctx, param, value):
+    """
+    :return: [(from_date, to_date)] of the `YYYY-MM` months
+    """
+    periods = []
+    for period in value:
+        try:
+            month = datetime.datetime.strptime(period, '%Y-%m')
+        except ValueError:
+            raise click.BadParameter('`{0}` is not a YYYY-MM month'.format(period))
+        first_day, last_day = RedmineAdapter.get_month_first_day_and_last_day(year=month.year, month=month.month)
+        periods.append((str(first_day), str(last_day)))
+    return periods
 
 
 @click.command()
@@ -673,17 +2948,75 @@ def process(*args, **kwargs):
 @click.option("--username", default='', help="SPDM username")
 @click.option("--password", default='', help="SPDM password")
 @click.option("--year", help="Statistical year,the default this year", default=0, type=click.IntRange(0, 9999))
-@click.option("--month", help="Statistical month", required=True, type=click.IntRange(1, 12))
+@click.option("--month", help="Statistical month", type=click.IntRange(1, 12))
+@click.option("--period", "periods", multiple=True, callback=parse_periods,
+              help="Statistical month as YYYY-MM, repeat it for one Excel per month")
+@click.option("--from-date", type=click.DateTime(formats=['%Y-%m-%d']),
+              help="first day of the statistical period, instead of --month")
+@click.option("--to-date", type=click.DateTime(formats=['%Y-%m-%d']), help="last day of the statistical period")
 @click.option("--enable-merge-cells", default=False, help="enable merge cells", is_flag=True)
-@click.option("--project", default=None, help="SPDM project identifier")
-def gen_excel(url, key, year, month, username, password, enable_merge_cells, project):
+@click.option("--project", multiple=True, help="SPDM project identifier, repeat it for one Excel per project")
+@click.option("--cache-file", default=None, help="local cache file, only changed data is downloaded on later runs")
+@click.option("--engine", default='memory', type=click.Choice(list(excel_adapters.keys())),
+              help="Excel engine, streaming keeps memory flat on large sheets")
+@click.option("--format", "output_format", default='xlsx', type=click.Choice(output_formats),
+              help="file format, csv, jsonl and parquet only hold the values and are written much faster")
+@click.option("--client", default='sync', type=click.Choice(list(redmine_adapters.keys())),
+              help="SPDM client, async sends the requests with asyncio")
+@click.option("--concurrency", default=4, type=click.IntRange(1, 64), help="SPDM requests sent at the same time")
+@click.option("--jobs", default=1, type=click.IntRange(1, 64),
+              help="processes rendering the rows, or writing the Excel files of a batch")
+@click.option("--row-mode", default='user', type=click.Choice(list(row_modes.keys())),
+              help="one row per project and user, per task of each user, or per time entry")
+@click.option("--pipeline", default=False, is_flag=True,
+              help="render the rows while they are downloaded, sorted by project and user")
+@click.option("--template-cache", "template_cache_dir", default=None,
+              help="directory keeping the compiled template between runs, it is parsed again when it changes")
+@click.option("--open-excel/--no-open-excel", default=True, help="open the generated Excel, only on Windows")
+@click.option("--profile", default=None, help="write the time and requests of each phase to this JSON file")
+@click.option("--cprofile", default=False, is_flag=True, help="with --profile, also write the cProfile stats as .prof")
+def gen_excel(url, key, year, month, periods, from_date, to_date, username, password, enable_merge_cells, project,
+              cache_file, engine, output_format, client, concurrency, jobs, row_mode, pipeline, template_cache_dir,
+              open_excel, profile, cprofile):
     """Generate Excel"""
+    if (from_date is None) != (to_date is None):
+        raise click.UsageError('"--from-date" and "--to-date" must be used together')
+    if periods and month is not None:
+        raise click.UsageError('"--month" can\'t be used with "--period"')
+    if year and (periods or from_date is not None):
+        raise click.UsageError('"--year" is only used with "--month"')
+    if pipeline and (periods or len(project) > 1):
+        raise click.UsageError('"--pipeline" can\'t be used with "--period" or several "--project"')
+    if from_date is not None:
+        if month is not None:
+            raise click.UsageError('"--month" can\'t be used with "--from-date"')
+        if from_date > to_date:
+            raise click.UsageError('"--from-date" must not be after "--to-date"')
+        from_date, to_date = str(from_date.date()), str(to_date.date())
+        if periods:
+            periods.append((from_date, to_date))
+    elif month is None and not periods:
+        raise click.UsageError('Missing option "--month", "--period" or "--from-date"')
+    if cprofile and profile is None:
+        raise click.UsageError('"--cprofile" requires "--profile"')
+    if template_cache_dir is not None:
+        template_cache.set_directory(template_cache_dir)
+    if profile is not None:
+        profiler.start(cprofile=cprofile)
     try:
-        process(url=url, key=key, year=year, month=month,
-                username=username, password=password, enable_merge_cells=enable_merge_cells, project=project)
+        process(url=url, key=key, year=year, month=month, periods=periods, from_date=from_date, to_date=to_date,
+                username=username, password=password, enable_merge_cells=enable_merge_cells, project=project,
+                cache_file=cache_file, engine=engine, output_format=output_format, client=client,
+                workers=concurrency, jobs=jobs, row_mode=row_mode, pipeline=pipeline, open_excel=open_excel)
     except Exception as e:
         click.echo(str(e))
+    finally:
+        if profile is not None:
+            profiler.stop()
+            profiler.dump(profile)
+            click.echo('Profile written to `{0}`'.format(profile))
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     gen_excel()
@@ -0,0 +1,245 @@
+# -- coding: utf-8 --
+
+"""
+Report service, generates the Excel of gen_excel over HTTP. The Redmine sessions and logins,
+the local store and the compiled template stay warm between the requests.
+
+    python service.py --url http://spdm/redmine/ --key xxxxx --port 8765
+
+    POST /reports  {"month": 6, "year": 2020, "project": "spd", "row_mode": "user"}
+                   -> {"name": "2020-06-01--2020-06-30 created on ... .xlsx"}
+    GET /reports/<name>  the Excel
+    GET /health
+"""
+
+import datetime
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote, urlparse
+
+import click
+
+from main import (FetchPlan, excel_adapters, generate_report, get_output_adapter, load_row_plan, output_formats,
+                  redmine_adapters, row_modes, template_cache)
+
+
+logger = logging.getLogger(__name__)
+
+content_types = {
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.csv': 'text/csv; charset=utf-8',
+    '.jsonl': 'application/jsonl; charset=utf-8',
+    '.parquet': 'application/vnd.apache.parquet',
+}
+
+
+class ReportService(object):
+    """
+    Reports are queued on `jobs` worker threads, each report borrows an idle RedmineAdapter
+    so the session, the login and the current user are not requested again.
+    Adapters older than `max_age` are logged in again, a login session may expire on the server.
+    """
+    def __init__(self, url, key='', username='', password='', workers=4, cache_file=None, client='sync', jobs=2,
+                 max_age=datetime.timedelta(minutes=30)):
+        self.redmine_options = dict(url=url, key=key, username=username, password=password, workers=workers,
+                                    cache_file=cache_file)
+        self.redmine_adapter = redmine_adapters[client]
+        self.max_age = max_age
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        #  (created at, RedmineAdapter), the last released adapter is used first
+        self._idle = queue.LifoQueue()
+        self._counter = itertools.count(1)
+
+    def acquire(self):
+        while True:
+            try:
+                created, redmine = self._idle.get_nowait()
+            except queue.Empty:
+                return time.monotonic(), self.redmine_adapter(**self.redmine_options)
+            if time.monotonic() - created < self.max_age.total_seconds():
+                return created, redmine
+            redmine.close()
+
+    def release(self, created, redmine):
+        self._idle.put((created, redmine))
+
+    @staticmethod
+    def get_period(options):
+        """
+        :return: the keyword arguments of RedmineAdapter.set_period
+        """
+        if options.get('from_date') is not None or options.get('to_date') is not None:
+            from_date, to_date = options.get('from_date'), options.get('to_date')
+            try:
+                if datetime.date.fromisoformat(from_date) > datetime.date.fromisoformat(to_date):
+                    raise ValueError('"from_date" must not be after "to_date"')
+            except TypeError:
+                raise ValueError('"from_date" and "to_date" must be used together')
+            return dict(from_date=from_date, to_date=to_date)
+        if options.get('month') is None:
+            raise ValueError('Missing "month" or "from_date"')
+        return dict(year=options.get('year', 0), month=options['month'])
+
+    def generate(self, options):
+        """
+        generate one Excel in a worker thread
+        :param options: month, year, from_date, to_date, project, row_mode, engine, format, enable_merge_cells,
+                        pipeline
+        :return: the name of the Excel
+        """
+        period = self.get_period(options)
+        row_mode = options.get('row_mode', 'user')
+        engine = options.get('engine', 'memory')
+        output_format = options.get('format', 'xlsx')
+        if row_mode not in row_modes or engine not in excel_adapters or output_format not in output_formats:
+            raise ValueError('Unknown row mode, engine or format')
+        row_plan = load_row_plan("template.xlsx")
+        fetch_plan = FetchPlan.from_row_plan(row_plan, row_mode)
+        created, redmine = self.acquire()
+        try:
+            redmine.set_period(**period)
+            redmine.fetch_plan = fetch_plan
+            target_name = generate_report(
+                redmine, row_plan, fetch_plan, get_output_adapter(engine, output_format),
+                redmine_project=options.get('project'), enable_merge_cells=options.get('enable_merge_cells', False),
+                row_mode=row_mode, pipeline=options.get('pipeline', False), open_excel=False,
+                target_name="{0}--{1} created on {2} #{3}.xlsx".format(
+                    redmine.from_date, redmine.to_date, datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),
+                    next(self._counter)))
+        except Exception:
+            #  the session may be broken, the adapter is not used again
+            redmine.close()
+            raise
+        self.release(created, redmine)
+        return target_name
+
+    def submit(self, options):
+        return self.executor.submit(self.generate, options)
+
+    def close(self):
+        self.executor.shutdown()
+        while not self._idle.empty():
+            self._idle.get_nowait()[1].close()
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.info(format, *args)
+
+    def address_string(self):
+        #  the client address of a Unix socket is empty
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    @property
+    def service(self) -> ReportService:
+        return self.server.service
+
+    def send_json(self, payload, status=200):
+        content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        parts = [unquote(part) for part in urlparse(self.path).path.split('/') if part]
+        if parts == ['health']:
+            return self.send_json({'status': 'ok'})
+        if len(parts) == 2 and parts[0] == 'reports' and os.path.basename(parts[1]) == parts[1] and \
+                os.path.splitext(parts[1])[1] in content_types:
+            path = os.path.join(os.getcwd(), 'work tables', parts[1])
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    content = f.read()
+                self.send_response(200)
+                self.send_header('Content-Type', content_types[os.path.splitext(parts[1])[1]])
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+        self.send_json({'error': 'Not found'}, status=404)
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip('/') != '/reports':
+            return self.send_json({'error': 'Not found'}, status=404)
+        try:
+            options = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(options, dict):
+                raise ValueError('The request must be a JSON object')
+            self.service.get_period(options)
+        except ValueError as e:
+            return self.send_json({'error': str(e)}, status=400)
+        try:
+            name = self.service.submit(options).result()
+        except ValueError as e:
+            return self.send_json({'error': str(e)}, status=400)
+        except Exception as e:
+            return self.send_json({'error': str(e) or 'Unsuccessfully generated'}, status=500)
+        self.send_json({'name': name})
+
+
+if hasattr(socket, 'AF_UNIX'):
+    from socketserver import UnixStreamServer
+
+    class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+        daemon_threads = True
+
+
+def create_server(service, host='127.0.0.1', port=8765, unix_socket=None):
+    """
+    :param unix_socket: path of a Unix socket to listen on instead of host and port
+    """
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, ReportRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ReportRequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+@click.command()
+@click.option("--url", default='http://spdm/redmine/', help="server address example: http://spdm/redmine/")
+@click.option("--key", default='', help="SPDM access token")
+@click.option("--username", default='', help="SPDM username")
+@click.option("--password", default='', help="SPDM password")
+@click.option("--cache-file", default=None, help="local cache file, only changed data is downloaded")
+@click.option("--client", default='sync', type=click.Choice(list(redmine_adapters.keys())), help="SPDM client")
+@click.option("--concurrency", default=4, type=click.IntRange(1, 64), help="SPDM requests sent at the same time")
+@click.option("--jobs", default=2, type=click.IntRange(1, 64), help="reports generated at the same time")
+@click.option("--template-cache", "template_cache_dir", default=None,
+              help="directory keeping the compiled template between runs")
+@click.option("--host", default='127.0.0.1', help="address to listen on")
+@click.option("--port", default=8765, type=click.IntRange(0, 65535), help="port to listen on")
+@click.option("--socket", "unix_socket", default=None, help="Unix socket to listen on instead of --host and --port")
+def serve(url, key, username, password, cache_file, client, concurrency, jobs, template_cache_dir, host, port,
+          unix_socket):
+    """Serve the reports over HTTP"""
+    if template_cache_dir is not None:
+        template_cache.set_directory(template_cache_dir)
+    service = ReportService(url, key=key, username=username, password=password, workers=concurrency,
+                            cache_file=cache_file, client=client, jobs=jobs)
+    server = create_server(service, host=host, port=port, unix_socket=unix_socket)
+    click.echo('Serving the reports on {0}'.format(unix_socket or 'http://{0}:{1}'.format(*server.server_address)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    serve()
@@ -1,11 +1,119 @@
 # -- coding: utf-8 --
 
+import contextlib
+import csv
+import datetime
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, urlparse
+
+import pytest
+import requests
 from click.testing import CliRunner
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
 
-from main import (ExcelAdapter, ColumnRawData, WorkTable, RedmineAdapter, gen_excel)
+from fake_redmine import FakeRedmineData, FakeRedmineHandler, FakeRedmineServer, make_time_entry
+from main import (ExcelAdapter, StreamingExcelAdapter, ColumnRawData, RowPlan, FetchPlan, TemplateCache, WorkTable,
+                  RedmineAdapter, AsyncRedmineAdapter, CustomRemoteProject, EntityStore, Profiler, gen_excel,
+                  load_row_plan, page_offsets, render_rows_parallel)
 
 
 TEST_REDMINE_URL = 'http://192.168.67.133:7777/redmine'
+#  seconds, `import main` took about 0.7s before the heavy imports were deferred
+IMPORT_TIME_BUDGET = 0.4
+HEAVY_MODULES = ('jinja2', 'openpyxl', 'redminelib', 'requests', 'lxml', 'aiohttp', 'asyncio', 'win32com',
+                 'numpy')
+
+
+def generate_fake_data(time_entry_count=250):
+    projects = [{'id': i, 'name': 'project{0}'.format(i), 'identifier': 'project{0}'.format(i)}
+                for i in range(1, 4)]
+    users = [{'id': i, 'login': 'user{0}'.format(i), 'firstname': 'first{0}'.format(i),
+              'lastname': 'last{0}'.format(i)} for i in range(1, 5)]
+    issues = [{'id': i, 'subject': 'issue{0}'.format(i), 'project': {'id': projects[i % 3]['id']}}
+              for i in range(1, 11)]
+    time_entries = []
+    for i in range(1, time_entry_count + 1):
+        issue = issues[i % len(issues)]
+        project = projects[i % 3]
+        time_entries.append(make_time_entry(i, project, users[i % len(users)],
+                                            issue=issue if i % 7 else None,
+                                            hours=0.5 * (i % 4 + 1),
+                                            spent_on='2020-06-{0:02d}'.format(i % 30 + 1)))
+    return FakeRedmineData(projects=projects, users=users, issues=issues, time_entries=time_entries)
+
+
+TEST_TEMPLATE_COLUMNS = [
+    ('项目名称', '{{ project.name }}{# merge #}'),
+    ('项目编号', '{{ project.identifier }}{# merge #}'),
+    ('姓名', '{{ current_user.fullname }}'),
+    ('工时', '{{ current_user.spent_time }}'),
+    ('任务数', '{{ current_user.tasks|list|length }}'),
+    ('部门', 'SPDM'),
+]
+
+
+@contextlib.contextmanager
+def template_directory(columns=TEST_TEMPLATE_COLUMNS):
+    """
+    create a template.xlsx in a temporary working directory
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        workbook = Workbook()
+        sheet = workbook.active
+        for column_index, (field_text, render_text) in enumerate(columns, 1):
+            header = sheet.cell(row=1, column=column_index, value=field_text)
+            header.font = Font(bold=True, color='FF0000')
+            sheet.cell(row=2, column=column_index, value=render_text)
+        sheet.column_dimensions['A'].width = 30
+        workbook.save(os.path.join(directory, 'template.xlsx'))
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+
+def dump_sheet(path):
+    sheet = load_workbook(path).active
+    return ([[cell.value for cell in row] for row in sheet.iter_rows()],
+            sorted(str(merged_range) for merged_range in sheet.merged_cells.ranges),
+            [cell.font.b for cell in sheet[1]],
+            sheet.column_dimensions['A'].width)
+
+
+def add_fake_project_tree(data, depth=3, width=3):
+    """
+    add a tree of projects below project 1
+    """
+    parents = [data.projects[0]]
+    for level in range(depth):
+        children = []
+        for parent in parents:
+            for i in range(width):
+                uid = len(data.projects) + 1
+                child = {'id': uid, 'name': 'project{0}'.format(uid), 'identifier': 'project{0}'.format(uid),
+                         'parent': {'id': parent['id']}}
+                data.projects.append(child)
+                children.append(child)
+        parents = children
+    return data
+
+
+def dump_projects(projects):
+    return [(project.uid, [(user.uid, [(task.uid, [work_time.uid for work_time in task.work_times])
+                                       for task in user.tasks])
+                           for user in project.users])
+            for project in projects.projects]
 
 
 class TestPowerpoint(object):
@@ -87,6 +195,971 @@ class TestRedmineAdapter(object):
         work_table.process()
 
 
+class TestFakeRedmineDownload(object):
+    def test_download_all_pages(self):
+        with FakeRedmineServer(generate_fake_data()) as server:
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, workers=4)
+            work_times = redmine._download_work_times()
+            # one page for the total count and two more fetched in parallel
+            assert server.count_requests('/time_entries.json') == 3
+        assert [work_time.id for work_time in work_times] == list(range(1, 251))
+
+    def test_page_offsets(self):
+        assert page_offsets(250, 100, 100) == (100, range(100, 250, 100))
+        # the server capped the limit to 30
+        assert list(page_offsets(100, 30, 100)[1]) == [30, 60, 90]
+        assert page_offsets(0, 0, 100) == (100, range(0, 0, 100))
+
+    def test_projects_tree_is_stable(self):
+        with FakeRedmineServer(generate_fake_data()) as server:
+            trees = []
+            for workers in (1, 8):
+                redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, workers=workers)
+                trees.append(dump_projects(redmine.get_projects()))
+        assert trees[0] == trees[1]
+        assert [project for project, users in trees[0]] == [2, 3, 1]
+        assert sum(len(work_times) for _, users in trees[0] for _, tasks in users
+                   for _, work_times in tasks) == 250 - 250 // 7
+
+
+class TestFakeRedminePrefetch(object):
+    def test_no_lazy_fetches_after_prefetch(self):
+        with FakeRedmineServer(generate_fake_data()) as server:
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020)
+            projects = redmine.get_projects()
+            requests_count = len(server.requests)
+            for project in projects.projects:
+                assert project.identifier == project.name
+                for user in project.users:
+                    assert user.fullname == '{0}{1}'.format(user.lastname, user.firstname)
+                    for task in user.tasks:
+                        assert task.subject == 'issue{0}'.format(task.uid)
+            assert len(server.requests) == requests_count
+            assert server.count_requests('/issues.json') == 1
+
+    def test_closed_projects_and_locked_users(self):
+        data = generate_fake_data()
+        data.projects[2]['status'] = 5
+        data.users[3]['status'] = 3
+        with FakeRedmineServer(data) as server:
+            for adapter_class in (RedmineAdapter, AsyncRedmineAdapter):
+                redmine = adapter_class(server.url, key='fake', month=6, year=2020)
+                projects = redmine.get_projects()
+                requests_count = len(server.requests)
+                assert sorted(project.identifier for project in projects.projects) == \
+                    ['project1', 'project2', 'project3']
+                assert 'last4first4' in [user.fullname for project in projects.projects for user in project.users]
+                assert len(server.requests) == requests_count
+                redmine.close()
+
+    def test_custom_fields(self):
+        data = generate_fake_data()
+        for project in data.projects:
+            project['custom_fields'] = [
+                {'id': 1, 'name': '项目编号', 'value': 'P{0:03d}'.format(project['id'])},
+                {'id': 2, 'name': '项目负责人', 'value': ''},
+            ]
+        with FakeRedmineServer(data) as server:
+            projects = RedmineAdapter(server.url, key='fake', month=6, year=2020).get_projects()
+            requests_count = len(server.requests)
+            for _ in range(3):
+                for project in projects.projects:
+                    assert project.custom_num == 'P{0:03d}'.format(project.uid)
+                    assert project.custom_leader == ''
+                    assert project.custom_category is None
+                    assert project.get_custom_fields()[1] == project.custom_num
+            assert len(server.requests) == requests_count
+            assert server.count_requests('/projects.json') == 1
+
+
+class FlakyRedmineHandler(FakeRedmineHandler):
+    """
+    the first request of every time entry page after the first one fails,
+    with a 503 or, for the second page, by closing the connection
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == '/time_entries.json' and query.get('offset', '0') != '0':
+            with self.server.lock:
+                failed = self.path in self.server.failed_paths
+                if not failed:
+                    self.server.failed_paths.add(self.path)
+                    self.server.requests.append((url.path, query))
+            if not failed and query['offset'] == '100':
+                self.close_connection = True
+                return
+            if not failed:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        return super(FlakyRedmineHandler, self).do_GET()
+
+
+class TestRetry(object):
+    def test_failed_pages_are_retried_alone(self):
+        for adapter_class in (RedmineAdapter, AsyncRedmineAdapter):
+            with FakeRedmineServer(generate_fake_data(450), handler=FlakyRedmineHandler) as server:
+                server.httpd.failed_paths = set()
+                redmine = adapter_class(server.url, key='fake', month=6, year=2020)
+                projects = redmine.get_projects()
+                redmine.close()
+                offsets = [int(query['offset']) for path, query in server.requests if path == '/time_entries.json']
+            assert sum(len(list(task.work_times)) for project in projects.projects for user in project.users
+                       for task in user.tasks) == 450 - 450 // 7
+            assert sorted(offsets) == [0, 100, 100, 200, 200, 300, 300, 400, 400]
+
+
+class TestDomainModel(object):
+    def test_compact_work_times(self):
+        with FakeRedmineServer(generate_fake_data()) as server:
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020)
+            projects = redmine.get_projects()
+            requests_count = len(server.requests)
+            work_times = [work_time for project in projects.projects for user in project.users
+                          for task in user.tasks for work_time in task.work_times]
+            assert not hasattr(work_times[0], '__dict__')
+            assert all(isinstance(work_time.hours, float) for work_time in work_times)
+            assert all(work_time.spent_on.month == 6 for work_time in work_times)
+            for project in projects.projects:
+                assert project.id == project.uid
+                for user in project.users:
+                    assert user.spent_time == round(sum(work_time.hours for task in user.tasks
+                                                        for work_time in task.work_times) / 8.0, 2)
+            assert len(server.requests) == requests_count
+
+    def test_aggregation(self):
+        with FakeRedmineServer(generate_fake_data()) as server:
+            projects = RedmineAdapter(server.url, key='fake', month=6, year=2020).get_projects()
+        work_times = [(project.uid, user.uid, task.uid, work_time) for project in projects.projects
+                      for user in project.users for task in user.tasks for work_time in task.work_times]
+        assert len(projects.time_entries) == len(work_times)
+        assert sum(projects.get_totals('project').values()) == sum(item[3].hours for item in work_times)
+        assert projects.get_totals('activity') == {9: sum(item[3].hours for item in work_times)}
+        assert set(projects.get_totals('day')) == set(item[3].spent_on for item in work_times)
+        for project in projects.projects:
+            for user in project.users:
+                for task in user.tasks:
+                    assert task.spent_time == sum(work_time.hours for work_time in task.work_times)
+        user = next(next(projects.projects).users)
+        task = next(user.tasks)
+        spent_time = user.spent_time, task.spent_time
+        task.get_work_time(make_time_entry(10000, {'id': 1, 'name': ''}, {'id': 1, 'firstname': '', 'lastname': ''},
+                                           hours=8.0, spent_on='2020-06-30'))
+        assert (user.spent_time, task.spent_time) == (spent_time[0] + 1, spent_time[1] + 8)
+
+
+class TestFakeRedmineCache(object):
+    def test_incremental_sync(self):
+        data = generate_fake_data()
+        with tempfile.TemporaryDirectory() as cache_dir, FakeRedmineServer(data) as server:
+            cache_file = os.path.join(cache_dir, 'cache.sqlite3')
+            expected = dump_projects(RedmineAdapter(server.url, key='fake', month=6, year=2020).get_projects())
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, cache_file=cache_file)
+            assert dump_projects(redmine.get_projects()) == expected
+
+            data.time_entries = [entry for entry in data.time_entries if entry['id'] != 3]
+            data.time_entries[0].update(hours=8.0, updated_on='2100-01-01T00:00:00Z')
+            del server.requests[:]
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, cache_file=cache_file)
+            projects = redmine.get_projects()
+            # the probe of the updated_on filter, the changed entries, the count and the id listing for the
+            # deleted entry
+            assert server.count_requests('/time_entries.json') == 1 + 2 + 3
+            assert 3 not in [work_time for project in dump_projects(projects) for _, tasks in project[1]
+                             for _, work_times in tasks for work_time in work_times]
+            work_time = projects.get_project_by_project_id(2).get_resource_by_uid(2).get_resource_by_uid(2)
+            assert work_time.get_resource_by_uid(1).hours == 8.0
+
+            redmine.close()
+
+            del server.requests[:]
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, cache_file=cache_file)
+            redmine.get_projects()
+            assert server.count_requests('/time_entries.json') == 1 + 2
+            redmine.close()
+
+    def test_server_without_updated_on_filter(self):
+        class UnfilteredData(FakeRedmineData):
+            @staticmethod
+            def is_updated(item, updated_on=None):
+                return True
+
+        data = generate_fake_data()
+        data = UnfilteredData(data.projects, data.users, data.issues, data.time_entries)
+        with tempfile.TemporaryDirectory() as cache_dir, FakeRedmineServer(data) as server:
+            cache_file = os.path.join(cache_dir, 'cache.sqlite3')
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, cache_file=cache_file)
+            redmine.get_projects()
+            redmine.close()
+            with pytest.raises(sqlite3.ProgrammingError):
+                redmine.store.get_synced_on('time_entry')
+
+            data.time_entries = [entry for entry in data.time_entries if entry['id'] != 3]
+            data.time_entries[0].update(hours=8.0)
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, cache_file=cache_file)
+            work_times = redmine._download_work_times()
+            assert redmine.updated_on_filter is False
+            assert [work_time.id for work_time in work_times] == [entry['id'] for entry in data.time_entries]
+            assert work_times[0].hours == 8.0
+            redmine.close()
+
+    def test_load_ids(self):
+        class RemoteResource(object):
+            def __init__(self, uid):
+                self.id = uid
+
+            def raw(self):
+                return {'id': self.id, 'subject': 'issue{0}'.format(self.id)}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            store = EntityStore(os.path.join(cache_dir, 'cache.sqlite3'))
+            store.select_chunk_size = 7
+            store.save('issue', [RemoteResource(uid) for uid in range(1, 51)], store.now())
+            store.save('project', [RemoteResource(1)], store.now())
+            assert list(store.load('issue', [42, 3, 3, 17, 99] + list(range(20, 30)))) == \
+                [3, 17] + list(range(20, 30)) + [42]
+            assert store.load('issue', []) == OrderedDict()
+            assert len(store.load('issue')) == 50
+            store.close()
+
+    def test_updated_issues(self):
+        data = generate_fake_data()
+        with tempfile.TemporaryDirectory() as cache_dir, FakeRedmineServer(data) as server:
+            cache_file = os.path.join(cache_dir, 'cache.sqlite3')
+            redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, cache_file=cache_file)
+            assert [issue.subject for issue in redmine.get_issues([5, 2])] == ['issue2', 'issue5']
+            data.issues[1].update(subject='changed', updated_on='2100-01-01T00:00:00Z')
+            del server.requests[:]
+            assert [issue.subject for issue in redmine.get_issues([5, 2, 7])] == ['changed', 'issue5', 'issue7']
+            # the unknown issue and the issues updated since they were stored
+            assert server.count_requests('/issues.json') == 2
+            redmine.close()
+
+
+class TestAsyncRedmineAdapter(object):
+    def test_same_projects_as_sync_adapter(self):
+        with FakeRedmineServer(generate_fake_data()) as server:
+            trees = []
+            for adapter_class in (RedmineAdapter, AsyncRedmineAdapter):
+                redmine = adapter_class(server.url, key='fake', month=6, year=2020, workers=3)
+                del server.requests[:]
+                projects = redmine.get_projects()
+                trees.append(dump_projects(projects))
+                for project in projects.projects:
+                    for user in project.users:
+                        assert user.fullname == '{0}{1}'.format(user.lastname, user.firstname)
+                redmine.close()
+                assert server.count_requests('/time_entries.json') == 3
+                assert server.count_requests('/issues.json') == 1
+        assert trees[0] == trees[1]
+
+    def test_sub_projects(self):
+        with FakeRedmineServer(add_fake_project_tree(generate_fake_data())) as server:
+            orders = []
+            for adapter_class in (RedmineAdapter, AsyncRedmineAdapter):
+                redmine = adapter_class(server.url, key='fake', month=6, year=2020, workers=3)
+                redmine.custom_session = requests.session()
+                orders.append([project.id for project in redmine.get_sub_projects(CustomRemoteProject(1, 'root'))])
+                redmine.close()
+        assert orders[0] == orders[1]
+        assert sorted(orders[0]) == [1] + list(range(4, 4 + 3 + 9 + 27))
+
+
+class TestRowPlan(object):
+    def test_render_same_as_column_templates(self):
+        columns = [ColumnRawData(column_index, field_text, render_text, None)
+                   for column_index, (field_text, render_text) in enumerate(TEST_TEMPLATE_COLUMNS + [
+                       ('a', '{{ missing }}'),
+                       ('b', '{{ project.missing }}'),
+                       ('c', '{% set name = 1 %}{{ name }}\n'),
+                       ('d', '{{ name }}'),
+                       ('e', '{{ project["name"] }} {{ current_user.tasks|list|length }}'),
+                   ], 1)]
+        row_plan = RowPlan(columns)
+        assert [column.kind for column in columns] == ['path', 'path', 'path', 'path', 'template', 'constant',
+                                                       'path', 'path', 'template', 'path', 'template']
+        assert row_plan.merges == [True, True, False, False, False, False, False, False, False, False, False]
+        with FakeRedmineServer(generate_fake_data()) as server:
+            projects = RedmineAdapter(server.url, key='fake', month=6, year=2020).get_projects()
+            for project in projects.projects:
+                for user in project.users:
+                    context = dict(project=project, current_user=user)
+                    expected = [column.render(**context) if column.can_render() else column.get_text()
+                                for column in columns]
+                    assert row_plan.render(**context) == expected
+
+
+class TestTemplateCache(object):
+    @staticmethod
+    def count_parses(function, cache):
+        """
+        :return: how many times the template file was parsed by `function` with `cache` as the template cache
+        """
+        import main
+
+        parses = []
+        parse = WorkTable.parse
+        template_cache = main.template_cache
+        WorkTable.parse = lambda self: parses.append(self) or parse(self)
+        main.template_cache = cache
+        try:
+            function()
+        finally:
+            WorkTable.parse = parse
+            main.template_cache = template_cache
+        return len(parses)
+
+    def test_parsed_once_per_content(self):
+        with template_directory(), tempfile.TemporaryDirectory() as cache_dir:
+            cache = TemplateCache()
+            row_plans = []
+            assert self.count_parses(lambda: row_plans.append(load_row_plan('template.xlsx')), cache) == 1
+            assert self.count_parses(lambda: row_plans.append(load_row_plan('template.xlsx')), cache) == 0
+            assert row_plans[0] is row_plans[1]
+            assert row_plans[0].sources == tuple(TEST_TEMPLATE_COLUMNS)
+
+            # a copy has the same content
+            with open('template.xlsx', 'rb') as src, open('copy.xlsx', 'wb') as dst:
+                dst.write(src.read())
+            assert self.count_parses(lambda: row_plans.append(load_row_plan('copy.xlsx')), cache) == 0
+            assert row_plans[2].sources == row_plans[0].sources
+
+            workbook = load_workbook('template.xlsx')
+            workbook.active.cell(row=2, column=6, value='IT')
+            workbook.save('template.xlsx')
+            assert self.count_parses(lambda: row_plans.append(load_row_plan('template.xlsx')), cache) == 1
+            assert row_plans[3].sources[5] == ('部门', 'IT')
+
+            # the layout and the bytecode are kept on disk
+            for parses in (1, 0):
+                cache = TemplateCache()
+                cache.set_directory(cache_dir)
+                assert self.count_parses(lambda: row_plans.append(load_row_plan('template.xlsx')), cache) == parses
+            assert row_plans[5].sources == row_plans[4].sources == row_plans[3].sources
+            assert any(name.startswith('__jinja2_') for name in os.listdir(cache_dir))
+
+    def test_columns_of_the_sheet(self):
+        columns = [('列{0}'.format(i), '{{{{ project.name }}}}{0}'.format(i)) for i in range(1, 121)]
+        with template_directory(columns):
+            row_plan = TemplateCache().load_row_plan('template.xlsx')
+        assert row_plan.sources == tuple(columns)
+
+
+class TestFetchPlan(object):
+    @staticmethod
+    def get_fetch_plan(*sources):
+        from jinja2 import Environment
+
+        fetch_plan = FetchPlan()
+        for source in sources:
+            fetch_plan.add_template(Environment().parse(source))
+        return fetch_plan
+
+    def test_resources(self):
+        assert self.get_fetch_plan('{{ project.name }}{# merge #}', '{{ current_user.spent_time }}',
+                                   '{{ current_user.tasks|list|length }}', 'SPDM').resources == set()
+        assert self.get_fetch_plan('{{ current_user.fullname }}', '{{ project.custom_num }}').resources == \
+            {'user', 'project'}
+        assert self.get_fetch_plan('{% for task in current_user.tasks %}{{ task.subject }}{% endfor %}').resources \
+            == {'issue'}
+        assert self.get_fetch_plan('{% set tasks = current_user.tasks %}{% for task in tasks %}'
+                                   '{% for work_time in task.work_times %}{{ work_time.activity.name }}'
+                                   '{% endfor %}{% endfor %}').resources == set()
+        assert self.get_fetch_plan('{% for task in current_user.tasks %}{% for work_time in task.work_times %}'
+                                   '{{ work_time.custom_fields }}{% endfor %}{% endfor %}').resources == {'time_entry'}
+        assert self.get_fetch_plan('{{ current_user.tasks|map(attribute="subject")|join }}').resources == {'issue'}
+        assert self.get_fetch_plan('{{ project }}').resources == {'project'}
+
+    def test_names_and_hours_need_no_prefetch(self):
+        columns = [('项目名称', '{{ project.name }}{# merge #}'), ('姓名', '{{ current_user.name }}'),
+                   ('工时', '{{ current_user.spent_time }}')]
+        for columns, paths in ((columns, []), (TEST_TEMPLATE_COLUMNS, ['/projects.json', '/users.json'])):
+            with FakeRedmineServer(generate_fake_data()) as server, template_directory(columns):
+                result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '6',
+                                                        '--year', '2020', '--no-open-excel'])
+                assert result.exit_code == 0
+                assert sorted(set(path for path, query in server.requests)) == \
+                    sorted(['/time_entries.json', '/users/current.json'] + paths)
+
+
+class TestParallelRendering(object):
+    columns = TEST_TEMPLATE_COLUMNS + [
+        ('任务', '{% for task in current_user.tasks %}{{ task.subject }}:{{ task.spent_time }};{% endfor %}'),
+        ('项目编号', '{{ project.custom_num }}'),
+        ('用户', '{{ current_user|attr("login") }}'),
+        ('未知', '{{ project.unknown }}'),
+    ]
+
+    def test_same_values_as_sequential(self):
+        data = generate_fake_data()
+        for project in data.projects:
+            project['custom_fields'] = [{'id': 1, 'name': '项目编号', 'value': 'P{0}'.format(project['id'])}]
+        with FakeRedmineServer(data) as server, template_directory(self.columns):
+            row_plan = load_row_plan('template.xlsx')
+            fetch_plan = FetchPlan.from_row_plan(row_plan)
+            projects = RedmineAdapter(server.url, key='fake', month=6, year=2020,
+                                      fetch_plan=fetch_plan).get_projects()
+            expected = [row_plan.render(project=project, current_user=user)
+                        for project, user in WorkTable.pre_process(projects)]
+            values = list(render_rows_parallel(row_plan, fetch_plan, WorkTable.pre_process(projects), 2,
+                                               chunk_size=3))
+        assert values == expected
+        assert expected[0][7:9] == ['P2', 'user2']
+
+    def test_cmd_jobs(self):
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory():
+            sheets = []
+            for jobs in ('1', '2'):
+                result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '6',
+                                                        '--year', '2020', '--no-open-excel', '--enable-merge-cells',
+                                                        '--jobs', jobs])
+                assert result.exit_code == 0
+                path = os.path.join('work tables', os.listdir('work tables')[0])
+                sheets.append(dump_sheet(path))
+                os.remove(path)
+        assert sheets[0] == sheets[1]
+        assert sheets[0][1]
+
+
+class TestRowModes(object):
+    columns = [
+        ('项目名称', '{{ project.name }}{# merge #}'),
+        ('姓名', '{{ current_user.fullname }}{# merge #}'),
+        ('任务', '{{ task.uid }}'),
+        ('日期', '{{ work_time.spent_on }}'),
+        ('工时', '{{ work_time.hours }}'),
+        ('活动', '{{ work_time.activity.name }}'),
+    ]
+
+    def test_rows_in_tree_order(self):
+        with FakeRedmineServer(generate_fake_data()) as server:
+            projects = RedmineAdapter(server.url, key='fake', month=6, year=2020).get_projects()
+        assert projects.get_rows('user') == [(project, user) for project in projects.projects
+                                             for user in project.users]
+        assert projects.get_rows('task') == [(project, user, task) for project in projects.projects
+                                             for user in project.users for task in user.tasks]
+        rows = projects.get_rows('time_entry')
+        assert [tuple(resource.uid for resource in row) for row in rows] == \
+            [(project.uid, user.uid, task.uid, work_time.uid) for project in projects.projects
+             for user in project.users for task in user.tasks for work_time in task.work_times]
+        #  the entries without an issue have no row
+        assert len(rows) == len([i for i in range(1, 251) if i % 7])
+        assert projects.get_rows('time_entry') is rows
+        work_time = rows[0][3]
+        assert work_time.activity == {'id': 9, 'name': 'Development'}
+        assert work_time.created_on == datetime.datetime(2020, 6, 2, 8)
+
+        task = rows[0][2]
+        task.get_work_time({'id': 1000, 'hours': 1.0, 'spent_on': '2020-06-01'})
+        assert len(projects.get_rows('time_entry')) == len(rows) + 1
+
+    def test_cmd_time_entry_rows(self):
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory(self.columns):
+            sheets = []
+            for jobs in ('1', '2'):
+                result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '6',
+                                                        '--year', '2020', '--no-open-excel', '--enable-merge-cells',
+                                                        '--row-mode', 'time_entry', '--jobs', jobs])
+                assert result.exit_code == 0
+                path = os.path.join('work tables', os.listdir('work tables')[0])
+                sheets.append(dump_sheet(path))
+                os.remove(path)
+            #  the work time columns are copied from the downloaded time entries
+            assert sorted(set(path for path, query in server.requests)) == \
+                ['/time_entries.json', '/users.json', '/users/current.json']
+        assert sheets[0] == sheets[1]
+        values = sheets[0][0]
+        assert len(values) == 1 + len([i for i in range(1, 251) if i % 7])
+        assert values[1] == ['project2', 'last2first2', '2', '2020-06-02', '1.0', 'Development']
+        assert sheets[0][1]
+
+
+class TestRowPipeline(object):
+    columns = TEST_TEMPLATE_COLUMNS + [
+        ('任务', '{{ task.subject }}'),
+        ('工时', '{{ work_time.hours }}'),
+    ]
+
+    @staticmethod
+    def generate_sheets(server, row_mode, *args):
+        sheets = []
+        for pipeline in ([], ['--pipeline']):
+            result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '6', '--year',
+                                                    '2020', '--no-open-excel', '--row-mode', row_mode] +
+                                        list(args) + pipeline)
+            assert result.exit_code == 0
+            path = os.path.join('work tables', os.listdir('work tables')[0])
+            sheets.append(dump_sheet(path)[0])
+            os.remove(path)
+        return sheets
+
+    def test_same_rows_sorted_by_project_and_user(self):
+        with FakeRedmineServer(generate_fake_data()) as server:
+            for row_mode, columns in (('user', TEST_TEMPLATE_COLUMNS), ('time_entry', self.columns)):
+                with template_directory(columns):
+                    sheet, pipeline_sheet = self.generate_sheets(server, row_mode)
+                assert pipeline_sheet[0] == sheet[0]
+                assert sorted(pipeline_sheet[1:]) == sorted(sheet[1:])
+                assert pipeline_sheet[1:] == sorted(pipeline_sheet[1:], key=lambda row: (row[0], row[2]))
+            sorted_requests = [query for path, query in server.requests
+                               if path == '/time_entries.json' and 'sort' in query]
+            assert sorted_requests and all(query['sort'] == 'project,user,id' for query in sorted_requests)
+
+    def test_names_equal_under_the_server_collation(self):
+        class CaseInsensitiveData(FakeRedmineData):
+            sort_keys = dict(FakeRedmineData.sort_keys, project=lambda entry: entry['project']['name'].lower(),
+                             user=lambda entry: entry['user']['name'].lower())
+
+        data = generate_fake_data()
+        data = CaseInsensitiveData(data.projects, data.users, data.issues, data.time_entries)
+        # project 2 and user 2 only differ in case from project 1 and user 1, their entries are interleaved
+        data.projects[1].update(name='PROJECT1')
+        data.users[1].update(firstname='FIRST1', lastname='LAST1')
+        for entry in data.time_entries:
+            user = data.get_user(entry['user']['id'])
+            entry['project']['name'] = data.get_project(entry['project']['id'])['name']
+            entry['user']['name'] = '{0} {1}'.format(user['firstname'], user['lastname'])
+        with FakeRedmineServer(data) as server, template_directory():
+            sheet, pipeline_sheet = self.generate_sheets(server, 'user')
+        assert len(pipeline_sheet) == len(sheet) == 1 + 3 * 4
+        assert sorted(pipeline_sheet[1:]) == sorted(sheet[1:])
+
+    def test_small_pages(self):
+        class SmallPageHandler(FakeRedmineHandler):
+            max_limit = 30
+
+        with FakeRedmineServer(generate_fake_data(1000), handler=SmallPageHandler) as server, \
+                template_directory():
+            sheet, pipeline_sheet = self.generate_sheets(server, 'user')
+        assert sorted(pipeline_sheet[1:]) == sorted(sheet[1:])
+
+    def test_issues_fetched_in_batches(self):
+        data = generate_fake_data(1000)
+        data.issues.extend({'id': i, 'subject': 'issue{0}'.format(i), 'project': {'id': 1}} for i in range(11, 151))
+        for entry in data.time_entries:
+            if 'issue' in entry:
+                entry['issue'] = {'id': entry['id'] % 150 + 1}
+        with FakeRedmineServer(data) as server, template_directory(self.columns):
+            requests_count = []
+            for pipeline in ([], ['--pipeline']):
+                del server.requests[:]
+                result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '6',
+                                                        '--year', '2020', '--no-open-excel',
+                                                        '--row-mode', 'time_entry'] + pipeline)
+                assert result.exit_code == 0
+                requests_count.append(server.count_requests('/issues.json'))
+        # the 150 issues shared by the groups, each one is requested once in pages of 100
+        assert requests_count == [2, 2]
+
+    def test_templates_reading_project_users(self):
+        columns = [('人数', '{{ project.users|list|length }}')]
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory(columns):
+            sheet, pipeline_sheet = self.generate_sheets(server, 'user')
+        assert pipeline_sheet == sheet
+
+
+class TestSubProjects(object):
+    def test_breadth_first_discovery(self):
+        data = add_fake_project_tree(generate_fake_data())
+        # project 2 joins the tree below project 4, project 3 stays outside
+        data.projects[1]['parent'] = {'id': 4}
+        with tempfile.TemporaryDirectory() as cache_dir, FakeRedmineServer(data) as server:
+            cache_file = os.path.join(cache_dir, 'cache.sqlite3')
+            for i in range(2):
+                redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020, workers=4, cache_file=cache_file)
+                redmine.custom_session = requests.session()
+                del server.requests[:]
+                sub_projects = list(redmine.get_sub_projects(CustomRemoteProject(1, 'root')))
+                redmine.close()
+                assert len(sub_projects) == len(set(sub_projects)) == len(data.projects) - 1
+                assert len(server.requests) == (len(sub_projects) if i == 0 else 0)
+
+    def test_time_entries_of_the_tree_only(self):
+        data = add_fake_project_tree(generate_fake_data(), depth=2, width=2)
+        for i, project in enumerate(data.projects[3:]):
+            data.time_entries.append(make_time_entry(1000 + i, project, data.users[i % 4], issue=data.issues[i % 10],
+                                                     spent_on='2020-06-{0:02d}'.format(i % 30 + 1)))
+        with FakeRedmineServer(data) as server:
+            for adapter_class in (RedmineAdapter, AsyncRedmineAdapter):
+                redmine = adapter_class(server.url, key='fake', month=6, year=2020)
+                redmine.custom_session = requests.session()
+                sub_projects = list(redmine.get_sub_projects(CustomRemoteProject(1, 'project1')))
+                expected = redmine.select_projects(redmine._get_projects(), sub_projects)
+                del server.requests[:]
+                projects = redmine.get_projects(redmine_project='project1')
+                redmine.close()
+                assert dump_projects(projects) == dump_projects(expected)
+                assert [user.spent_time for project in projects.projects for user in project.users] == \
+                    [user.spent_time for project in expected.projects for user in project.users]
+                assert projects.get_totals('project') == expected.get_totals('project')
+                tree_ids = set(project.id for project in sub_projects)
+                assert sum(projects.get_totals('project').values()) == sum(
+                    entry['hours'] for entry in data.time_entries if entry['project']['id'] in tree_ids and
+                    'issue' in entry and entry['spent_on'] <= '2020-06-30')
+                queries = [query for path, query in server.requests if path == '/time_entries.json']
+                assert sorted(int(query['project_id']) for query in queries) == \
+                    sorted(project.id for project in sub_projects)
+                assert all(query['subproject_id'] == '!*' for query in queries)
+
+    def test_failed_children_are_not_skipped(self):
+        class ChildrenErrorHandler(FakeRedmineHandler):
+            #  {project id: status of its /children}
+            statuses = {'2': 404, '4': 500}
+
+            def do_GET(self):
+                parts = [part for part in urlparse(self.path).path.split('/') if part]
+                if len(parts) == 3 and parts[2] == 'children' and parts[1] in self.statuses:
+                    self.send_response(self.statuses[parts[1]])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                return super(ChildrenErrorHandler, self).do_GET()
+
+        data = add_fake_project_tree(generate_fake_data(), depth=2, width=2)
+        with FakeRedmineServer(data, handler=ChildrenErrorHandler) as server:
+            for adapter_class in (RedmineAdapter, AsyncRedmineAdapter):
+                redmine = adapter_class(server.url, key='fake', month=6, year=2020)
+                redmine.custom_session = requests.session()
+                try:
+                    # a project without visible children is a leaf
+                    assert [project.id for project in
+                            redmine.get_sub_projects(CustomRemoteProject(2, 'project2'))] == [2]
+                    with pytest.raises(Exception):
+                        list(redmine.get_sub_projects(CustomRemoteProject(1, 'project1')))
+                finally:
+                    redmine.close()
+
+
+class TestBatch(object):
+    @staticmethod
+    def generate_fake_data():
+        data = add_fake_project_tree(generate_fake_data(), depth=1)
+        data.projects[1]['parent'] = {'id': 1}
+        for i in range(1, 121):
+            data.time_entries.append(make_time_entry(1000 + i, data.projects[i % len(data.projects)],
+                                                     data.users[i % 3], issue=data.issues[i % 5], hours=1.5,
+                                                     spent_on='2020-07-{0:02d}'.format(i % 31 + 1)))
+        return data
+
+    def test_same_projects_as_single_runs(self):
+        periods = [('2020-06-01', '2020-06-30'), ('2020-07-01', '2020-07-31')]
+        redmine_projects = ['project1', 'project3', None]
+        with FakeRedmineServer(self.generate_fake_data()) as server:
+            redmine = RedmineAdapter(server.url, key='fake')
+            redmine.custom_session = requests.session()
+            del server.requests[:]
+            batch = redmine.get_batch_projects(periods, redmine_projects)
+            assert server.count_requests('/time_entries.json') == 4
+            assert len(batch) == 6
+            for (from_date, to_date), redmine_project, projects in batch:
+                redmine = RedmineAdapter(server.url, key='fake', month=int(from_date[5:7]), year=2020)
+                redmine.custom_session = requests.session()
+                expected = dump_projects(redmine.get_projects(redmine_project=redmine_project))
+                assert expected
+                assert dump_projects(projects) == expected
+
+    def test_write_workbooks_in_processes(self):
+        with FakeRedmineServer(self.generate_fake_data()) as server, template_directory():
+            runner = CliRunner()
+            sheets = []
+            for args in (['--month', '6', '--year', '2020'], ['--month', '7', '--year', '2020'],
+                         ['--period', '2020-06', '--period', '2020-07', '--jobs', '2']):
+                result = runner.invoke(gen_excel, ['--key', 'fake', '--url', server.url] + args)
+                assert result.exit_code == 0
+                names = sorted(os.listdir('work tables'))
+                sheets.extend(dump_sheet(os.path.join('work tables', name)) for name in names)
+                for name in names:
+                    os.remove(os.path.join('work tables', name))
+        assert len(sheets) == 4
+        assert sheets[:2] == sheets[2:]
+        assert sheets[0] != sheets[1]
+
+    def test_ignored_options_are_refused(self):
+        runner = CliRunner()
+        for args, message in (
+                (['--period', '2020-06', '--month', '6'], '"--month" can\'t be used with "--period"'),
+                (['--period', '2020-06', '--year', '2020'], '"--year" is only used with "--month"'),
+                (['--from-date', '2020-06-01', '--to-date', '2020-06-30', '--year', '2020'],
+                 '"--year" is only used with "--month"'),
+                (['--period', '2020-06', '--pipeline'], '"--pipeline" can\'t be used with "--period"'),
+                (['--month', '6', '--project', 'project1', '--project', 'project2', '--pipeline'],
+                 '"--pipeline" can\'t be used with "--period" or several "--project"')):
+            result = runner.invoke(gen_excel, ['--key', 'fake', '--url', 'http://127.0.0.1:1'] + args)
+            assert result.exit_code == 2
+            assert message in result.output
+
+
+class TestDateRange(object):
+    def test_split_period(self):
+        assert RedmineAdapter.split_period('2020-06-01', '2020-06-30', 7) == [
+            ('2020-06-01', '2020-06-07'), ('2020-06-08', '2020-06-14'), ('2020-06-15', '2020-06-21'),
+            ('2020-06-22', '2020-06-28'), ('2020-06-29', '2020-06-30')]
+        assert RedmineAdapter.split_period('2020-06-01', '2020-06-01', 7) == [('2020-06-01', '2020-06-01')]
+
+    def test_sub_periods_paginated_separately(self):
+        with FakeRedmineServer(TestBatch.generate_fake_data()) as server:
+            for adapter_class in (RedmineAdapter, AsyncRedmineAdapter):
+                redmine = adapter_class(server.url, key='fake', from_date='2020-06-01', to_date='2020-07-31')
+                expected = [work_time.id for work_time in redmine._download_work_times()]
+                redmine.max_period_pages = 1
+                del server.requests[:]
+                assert [work_time.id for work_time in redmine._download_work_times()] == expected
+                redmine.close()
+                periods = set((query['from'], query['to']) for path, query in server.requests)
+                assert len(expected) == 370
+                assert len(periods) == 1 + 9
+                # every week fits in its first page
+                assert max(int(query['offset']) for path, query in server.requests) == 0
+
+    def test_cmd_from_date_to_date(self):
+        with FakeRedmineServer(TestBatch.generate_fake_data()) as server, template_directory():
+            runner = CliRunner()
+            result = runner.invoke(gen_excel, ['--key', 'fake', '--url', server.url,
+                                               '--from-date', '2020-06-01', '--to-date', '2020-07-31'])
+            assert result.exit_code == 0
+            names = os.listdir('work tables')
+            assert len(names) == 1 and names[0].startswith('2020-06-01--2020-07-31')
+            result = runner.invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--from-date', '2020-06-01'])
+            assert result.exit_code == 2
+
+
+class TestStreamingExcelAdapter(object):
+    def test_same_output_as_memory_engine(self):
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory():
+            sheets = []
+            for adapter_class in (ExcelAdapter, StreamingExcelAdapter):
+                redmine = RedmineAdapter(server.url, key='fake', month=6, year=2020)
+                adapter = adapter_class('template.xlsx', '{0}.xlsx'.format(adapter_class.__name__))
+                WorkTable(adapter, redmine.get_projects(), enable_merge=True).process()
+                sheets.append(dump_sheet(adapter.target_file_path))
+        assert sheets[0] == sheets[1]
+        assert len(sheets[0][0]) == 1 + 12
+        assert sheets[0][1] == ['A10:A13', 'A2:A5', 'A6:A9', 'B10:B13', 'B2:B5', 'B6:B9']
+
+
+class TestTableAdapters(object):
+    @staticmethod
+    def generate(server, *args):
+        result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '6', '--year', '2020',
+                                                '--no-open-excel'] + list(args))
+        assert result.exit_code == 0
+        names = os.listdir('work tables')
+        assert len(names) == 1
+        path = os.path.join('work tables', names[0])
+        yield path
+        os.remove(path)
+
+    def test_same_values_as_excel(self):
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory():
+            for path in self.generate(server):
+                rows = dump_sheet(path)[0]
+            for path in self.generate(server, '--format', 'csv', '--enable-merge-cells'):
+                assert path.endswith('.csv')
+                with open(path, newline='', encoding='utf-8-sig') as f:
+                    assert list(csv.reader(f)) == rows
+            for path in self.generate(server, '--format', 'jsonl', '--pipeline'):
+                assert path.endswith('.jsonl')
+                with open(path, encoding='utf-8') as f:
+                    objects = [json.loads(line) for line in f]
+                # the pipeline sorts the rows by project and user
+                assert sorted(list(item.values()) for item in objects) == sorted(rows[1:])
+                assert list(objects[0].keys()) == rows[0]
+        # the first column is merged in the Excel, every row repeats it
+        assert len(rows) == 1 + 12
+        assert all(row[0] for row in rows)
+
+    def test_parquet(self):
+        parquet = pytest.importorskip('pyarrow.parquet')
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory():
+            for path in self.generate(server):
+                rows = dump_sheet(path)[0]
+            for path in self.generate(server, '--format', 'parquet', '--jobs', '2'):
+                assert path.endswith('.parquet')
+                table = parquet.read_table(path)
+        assert table.column_names == rows[0]
+        assert [list(row.values()) for row in table.to_pylist()] == rows[1:]
+
+    def test_repeated_header(self):
+        columns = [('名称', '{{ project.name }}'), ('名称', '{{ current_user.fullname }}'),
+                   ('名称_2', '{{ current_user.spent_time }}'), ('名称', 'SPDM')]
+        formats = ['csv', 'jsonl']
+        parquet = None
+        try:
+            import pyarrow.parquet as parquet
+            formats.append('parquet')
+        except ImportError:
+            pass
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory(columns):
+            for path in self.generate(server):
+                rows = dump_sheet(path)[0][1:]
+            header = ['名称', '名称_3', '名称_2', '名称_4']
+            for output_format in formats:
+                for path in self.generate(server, '--format', output_format):
+                    if output_format == 'csv':
+                        with open(path, newline='', encoding='utf-8-sig') as f:
+                            table = list(csv.reader(f))
+                        assert table == [header] + rows
+                    elif output_format == 'jsonl':
+                        with open(path, encoding='utf-8') as f:
+                            objects = [json.loads(line) for line in f]
+                        assert [list(item.keys()) for item in objects] == [header] * len(rows)
+                        assert [list(item.values()) for item in objects] == rows
+                    else:
+                        table = parquet.read_table(path)
+                        assert table.column_names == header
+                        assert [list(row.values()) for row in table.to_pylist()] == rows
+
+    def test_no_file_without_rows(self):
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory():
+            result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '1',
+                                                    '--year', '2020', '--format', 'csv', '--no-open-excel'])
+            assert 'no data was generated' in result.output
+            assert os.listdir('work tables') == []
+
+
+class TestImport(object):
+    def test_import_is_lazy(self):
+        code = ('import sys, time\n'
+                'started = time.perf_counter()\n'
+                'import main\n'
+                'print(time.perf_counter() - started)\n'
+                'print(",".join(name for name in {0!r} if name in sys.modules))').format(HEAVY_MODULES)
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         universal_newlines=True).splitlines()
+        assert output[1] == ''
+        assert float(output[0]) < IMPORT_TIME_BUDGET
+
+    def test_no_open_excel(self):
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory():
+            result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '6',
+                                                    '--year', '2020', '--no-open-excel'])
+            assert result.exit_code == 0
+            assert len([name for name in os.listdir('work tables') if name.startswith('2020-06-01--2020-06-30')]) == 1
+
+
+class TestService(object):
+    @staticmethod
+    def post(url, **options):
+        response = requests.post(url + '/reports', json=options)
+        return response.status_code, response.json()
+
+    def test_reports(self):
+        from service import ReportService, create_server
+
+        with FakeRedmineServer(generate_fake_data()) as redmine_server, template_directory():
+            result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', redmine_server.url, '--month', '6',
+                                                    '--year', '2020', '--no-open-excel'])
+            assert result.exit_code == 0
+            expected = dump_sheet(os.path.join('work tables', os.listdir('work tables')[0]))
+
+            service = ReportService(redmine_server.url, key='fake', jobs=2)
+            server = create_server(service, port=0)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+            try:
+                assert requests.get(url + '/health').json() == {'status': 'ok'}
+                del redmine_server.requests[:]
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    responses = list(executor.map(lambda i: self.post(url, month=6, year=2020), range(3)))
+                assert [status for status, payload in responses] == [200] * 3
+                names = [payload['name'] for status, payload in responses]
+                assert len(set(names)) == 3
+                for name in names:
+                    response = requests.get(url + '/reports/' + quote(name))
+                    assert response.status_code == 200
+                    with open('downloaded.xlsx', 'wb') as f:
+                        f.write(response.content)
+                    assert dump_sheet('downloaded.xlsx') == expected
+                # two workers, each logged in once
+                assert redmine_server.count_requests('/users/current.json') == 2
+
+                status, payload = self.post(url, month=6, year=2020)
+                assert status == 200
+                assert redmine_server.count_requests('/users/current.json') == 2
+                assert self.post(url, year=2020)[0] == 400
+                assert self.post(url, month=13)[0] == 400
+                assert self.post(url, month=6, row_mode='unknown')[0] == 400
+                assert self.post(url, month=6, format='unknown')[0] == 400
+                status, payload = self.post(url, month=6, year=2020, format='csv')
+                assert status == 200 and payload['name'].endswith('.csv')
+                response = requests.get(url + '/reports/' + quote(payload['name']))
+                assert response.headers['Content-Type'] == 'text/csv; charset=utf-8'
+                assert response.content.decode('utf-8-sig').splitlines()[0] == ','.join(expected[0][0])
+                assert requests.get(url + '/reports/..%2Ftemplate.xlsx').status_code == 404
+            finally:
+                server.shutdown()
+                server.server_close()
+                service.close()
+
+
+class TestProfile(object):
+    def test_profile_report(self):
+        with FakeRedmineServer(generate_fake_data()) as server, template_directory():
+            result = CliRunner().invoke(gen_excel, ['--key', 'fake', '--url', server.url, '--month', '6',
+                                                    '--year', '2020', '--no-open-excel',
+                                                    '--profile', 'profile.json', '--cprofile'])
+            assert result.exit_code == 0
+            with open('profile.json') as f:
+                report = json.load(f)
+            assert os.path.exists('profile.prof')
+            requests_count = len(server.requests)
+        for phase in ('_get_projects', '_download_work_times', 'build_projects', 'prefetch', 'parse', 'render',
+                      'merge_all_cells', 'save'):
+            assert report['phases'][phase]['calls'] == 1
+        assert report['requests'] == requests_count
+        assert report['phases']['_download_work_times']['requests'] == 3
+        assert report['bytes'] > 0
+        assert report['lazy_fetches'] == 0
+        assert report['seconds'] >= report['phases']['_get_projects']['seconds']
+
+    def test_phases_of_each_thread(self):
+        profiler = Profiler()
+        profiler.start()
+        opened, closed = threading.Event(), threading.Event()
+
+        def other_thread():
+            with profiler.phase('other_thread'):
+                opened.set()
+                closed.wait(5)
+                profiler.count_request(1, 0.0)
+
+        with profiler.phase('main'):
+            with profiler.phase('download'):
+                thread = threading.Thread(target=other_thread)
+                thread.start()
+                opened.wait(5)
+                # the phase open in the other thread doesn't take the requests of this one
+                profiler.count_request(10, 0.0)
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    list(executor.map(profiler.bind(lambda size: profiler.count_request(size, 0.0)), [100, 1000]))
+            closed.set()
+            thread.join()
+            profiler.count_request(10000, 0.0)
+        profiler.count_request(100000, 0.0)
+        profiler.stop()
+        phases = profiler.report()['phases']
+        assert phases['download']['bytes'] == 1110
+        assert phases['other_thread']['bytes'] == 1
+        assert phases['main']['bytes'] == 10000
+        assert phases['other']['bytes'] == 100000
+
+
+class TestBenchmarks(object):
+    def test_suite_runs_offline(self):
+        from benchmarks import generate_dataset, run_suite, template_directory as benchmark_directory
+
+        data = generate_dataset(500)
+        assert [project.get('parent', {}).get('id') for project in data.projects[:8]] == [None, 1, 1, 2, 2, 3, 3, None]
+        with FakeRedmineServer(data) as server, benchmark_directory():
+            steps = list(run_suite(server.url, 500, 'memory', memory=False))
+            rows = dump_sheet(os.path.join('work tables', 'benchmark.xlsx'))[0]
+        assert [step for step, seconds, peak in steps] == ['get_projects', 'process', 'gen_excel']
+        assert rows[1][1:3] == ['P0002', 'leader2']
+
+
 class TestCmd(object):
     def test_gen_ppt(self):
         runner = CliRunner()